@@ -1,53 +1,303 @@
 import argparse
-from collections import defaultdict
+import hashlib
+import json
+from collections import defaultdict, OrderedDict
 import numpy as np
 import os
 from enum import Enum
+import functools
 import itertools
-import pandas as pd
-from utils import get_all_files_paths
-import matplotlib
-import matplotlib.pyplot as plt
-from scipy import stats
+import mmap
+import multiprocessing
+import sys
+import warnings
+from instrumentation import instrumentation
+from utils import BOOTSTRAP_CONFIDENCE, COMPRESSION_SUFFIXES, ROWS_NUMBER, PathFilter, ShardedFile, \
+    add_bootstrap_arguments, add_path_filter_arguments, add_preview_arguments, add_rows_arguments, \
+    add_sharded_arguments, add_tests_arguments, get_compression, iter_files_paths, iter_sharded_files, \
+    open_result_file, strip_compression_suffix, write_json_atomically
 
 
 LEGEND = False
 FONT_SIZE = 22
-
-matplotlib.rcParams.update({'font.size': FONT_SIZE})
-
-
-def agg_row(data_file_path):
-    values = []
-    line_no = 0
-    with open(data_file_path, 'r') as data_file:
-        for line in data_file:
-            values.append(int(line))
-            line_no += 1
-            if line_no >= 100:
+READ_BLOCK_SIZE = 64 * 1024
+FILES_CHUNK_SIZE = 250
+CHARTS_INDEX_FILE = '.charts.json'
+LINE_STYLES = ['x-', '^-', 's-', 'p-', 'h-', 'o-']
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_BATCH_VALUES = 4 * 1024 * 1024
+PREVIEW_SEED = 0
+DATA_TYPE_FILES = ['foundsolutionsnumber.csv', 'epsvalues.csv', 'relationsnumbers.csv', 'prefindrelationsnumbers.csv']
+
+
+class MissingResultsError(Exception):
+    """
+    Results needed by an aggregation are missing, e.g. parameters not run yet in a campaign in progress
+    """
+
+
+def read_rows(data_file_path, skip_na, rows_number=ROWS_NUMBER):
+    """
+    Read the first rows of a result file in blocks, without iterating over it line by line.
+    Compressed files are decompressed block by block, so only their beginning is decompressed.
+    :param data_file_path: path to the result file
+    :param skip_na: whether rows containing NA should be skipped
+    :param rows_number: number of rows to read, all rows if None
+    :return: list of rows
+    """
+    return read_rows_counting_na(data_file_path, skip_na, rows_number)[0]
+
+
+def read_rows_counting_na(data_file_path, skip_na, rows_number=ROWS_NUMBER):
+    """
+    Read the first rows of a result file as read_rows does
+    :return: list of rows, numpy.ndarray of indices of the rows in the file and number of skipped rows containing NA
+    """
+    rows = []
+    row_indices = []
+    na_rows = 0
+    rest = ''
+    instrumentation.count('files_read')
+    with open_result_file(data_file_path) as data_file:
+        while rows_number is None or len(rows) < rows_number:
+            block = data_file.read(READ_BLOCK_SIZE)
+            instrumentation.count('bytes_read', len(block))
+            if block:
+                block_rows = (rest + block).split('\n')
+                rest = block_rows.pop()
+            else:
+                block_rows = [rest] if rest else []
+            kept_rows, kept_indices, block_na_rows = keep_rows(
+                block_rows, skip_na, rows_number - len(rows) if rows_number is not None else None, data_file_path,
+                len(rows) + na_rows)
+            rows.extend(kept_rows)
+            row_indices.extend(kept_indices)
+            na_rows += block_na_rows
+            if not block:
+                break
+    return rows, np.array(row_indices, dtype=np.int64), na_rows
+
+
+def keep_rows(rows, skip_na, rows_left, data_file_path, first_row=0):
+    """
+    Select rows read by aggregations among consecutive rows of a result file
+    :param skip_na: whether rows containing NA should be skipped
+    :param rows_left: number of rows still to read, all rows if None
+    :param first_row: index of the first of the rows in the file
+    :return: kept rows, indices of the kept rows in the file and number of skipped rows containing NA
+    """
+    if not skip_na or not any('NA' in row for row in rows):
+        kept_rows = rows[:rows_left] if rows_left is not None else rows
+        return kept_rows, range(first_row, first_row + len(kept_rows)), 0
+    kept_rows = []
+    kept_indices = []
+    na_rows = 0
+    for row_idx, row in enumerate(rows, first_row):
+        if rows_left is not None and len(kept_rows) >= rows_left:
+            break
+        if 'NA' in row:
+            print 'Found NA in file: %s' % data_file_path
+            instrumentation.count('na_rows')
+            na_rows += 1
+            continue
+        kept_rows.append(row)
+        kept_indices.append(row_idx)
+    return kept_rows, kept_indices, na_rows
+
+
+class MappedResultFile:
+    """
+    Uncompressed result file mapped into memory.
+
+    Rows are found with vectorized searches of newlines in a window at the beginning of the mapping, doubled
+    until it holds enough rows, and only the text of the selected rows is copied out of the mapping to be parsed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._bytes = np.frombuffer(self._map, dtype=np.uint8)
+        else:
+            self._map = None
+            self._bytes = np.zeros(0, dtype=np.uint8)
+
+    def close(self):
+        # the array must not outlive the mapping it points to
+        self._bytes = None
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_rows_text(self, skip_na, rows_number=ROWS_NUMBER):
+        """
+        Read the first rows of the file
+        :param skip_na: whether rows containing NA should be skipped
+        :param rows_number: number of rows to read, all rows if None
+        :return: text of the rows joined by commas, indices of the rows in the file and numbers of their values
+        """
+        instrumentation.count('files_read')
+        size = len(self._bytes)
+        window_size = READ_BLOCK_SIZE
+        while True:
+            window_end = size if rows_number is None else min(size, window_size)
+            row_starts, row_ends = self._find_rows(window_end)
+            kept = np.ones(len(row_starts), dtype=bool)
+            if skip_na:
+                kept[self._find_na_rows(window_end, row_ends)] = False
+            kept_rows = np.flatnonzero(kept)
+            if window_end == size or len(kept_rows) >= rows_number:
                 break
-    if line_no < 100:
-        raise Exception('Found only %d proper values of 100' % line_no)
+            window_size *= 2
+        instrumentation.count('bytes_read', window_end)
+        kept_rows = kept_rows[:rows_number]
+        na_rows_number = kept_rows[-1] + 1 - len(kept_rows) if len(kept_rows) else 0
+        if na_rows_number:
+            # the same messages as of read_rows, written at once
+            sys.stdout.write(('Found NA in file: %s\n' % self.path) * na_rows_number)
+            instrumentation.count('na_rows', na_rows_number)
+        return self._get_text(row_starts, row_ends, kept_rows), kept_rows, \
+            self._count_values(window_end, row_ends)[kept_rows]
+
+    def _find_rows(self, window_end):
+        """
+        Find rows complete in the window, the last row of the file may have no newline
+        :return: arrays of starts and ends of rows
+        """
+        newlines = np.flatnonzero(self._bytes[:window_end] == ord('\n'))
+        row_starts = np.concatenate([[0], newlines + 1])
+        row_ends = np.append(newlines, window_end)
+        if window_end < len(self._bytes) or row_starts[-1] == window_end:
+            row_starts, row_ends = row_starts[:-1], row_ends[:-1]
+        return row_starts, row_ends
+
+    def _find_na_rows(self, window_end, row_ends):
+        window = self._bytes[:window_end]
+        na_positions = np.flatnonzero((window[:-1] == ord('N')) & (window[1:] == ord('A')))
+        na_rows = np.searchsorted(row_ends, na_positions, side='right')
+        return na_rows[na_rows < len(row_ends)]
+
+    def _count_values(self, window_end, row_ends):
+        """
+        Count comma separated values of every row of the window
+        """
+        commas = np.flatnonzero(self._bytes[:window_end] == ord(','))
+        if not len(commas):
+            return np.ones(len(row_ends), dtype=np.int64)
+        comma_rows = np.searchsorted(row_ends, commas, side='right')
+        return np.bincount(comma_rows, minlength=len(row_ends) + 1)[:len(row_ends)] + 1
+
+    def _get_text(self, row_starts, row_ends, rows):
+        """
+        Copy the text of the given rows, as few slices of consecutive rows
+        """
+        if not len(rows):
+            return ''
+        run_breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        run_firsts = rows[np.concatenate([[0], run_breaks])]
+        run_lasts = rows[np.append(run_breaks - 1, len(rows) - 1)]
+        return ','.join(self._map[row_starts[first]:row_ends[last]]
+                        for first, last in zip(run_firsts, run_lasts)).replace('\n', ',')
+
+
+def read_rows_text(data_file_path, skip_na, rows_number=ROWS_NUMBER):
+    """
+    Read the first rows of a result file, through a memory mapping unless the file is compressed or given by
+    files of shards
+    :param rows_number: number of rows to read, all rows if None, which must be at least ROWS_NUMBER
+    :return: text of the rows joined by commas, indices of the rows in the file and numbers of their values
+    """
+    if not isinstance(data_file_path, ShardedFile) and get_compression(data_file_path) is None:
+        with MappedResultFile(data_file_path) as result_file:
+            text, row_indices, row_sizes = result_file.read_rows_text(skip_na, rows_number)
+    else:
+        rows, row_indices, _ = read_rows_counting_na(data_file_path, skip_na, rows_number)
+        text, row_sizes = ','.join(rows), get_row_sizes(rows)
+    if len(row_indices) < (rows_number or ROWS_NUMBER):
+        raise Exception('Found only %d proper values of %d' % (len(row_indices), rows_number or ROWS_NUMBER))
+    return text, row_indices, row_sizes
+
+
+def parse_rows(text, data_file_path):
+    """
+    Convert comma separated rows into a flat float64 array in a single numpy call
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(text, dtype=np.float64, sep=',')
+    if len(values) != text.count(',') + 1:
+        raise ValueError('Could not convert row to numbers in file: %s' % data_file_path)
+    instrumentation.count('values_parsed', len(values))
     return values
 
 
-def agg_rowcol(data_file_path):
-    values = []
-    line_no = 0
-    with open(data_file_path, 'r') as data_file:
-        for line in data_file:
-            if 'NA' in line:
-                print 'Found NA in file: %s' % data_file_path
-                continue
-            values.extend([float(v) for v in line.split(',')])
-            line_no += 1
-            if line_no >= 100:
-                break
-    if line_no < 100:
-        raise Exception('Found only %d proper values of 100' % line_no)
+def check_single_integers(values, rows_number, data_file_path):
+    """
+    Check that rows of a file of numbers of found solutions hold a single integer each
+    """
+    if len(values) != rows_number or np.any(values != np.floor(values)):
+        raise ValueError('Expected a single integer per row in file: %s' % data_file_path)
+
+
+def parse_data_rows(rows, data_type, data_file_path):
+    """
+    Parse rows of a result file of the given data type, selected as by read_rows with skips_na(data_type)
+    :return: flat float64 array of values of the rows
+    """
+    if not rows:
+        return np.zeros(0)
+    values = parse_rows(','.join(rows), data_file_path)
+    if not skips_na(data_type):
+        check_single_integers(values, len(rows), data_file_path)
     return values
 
 
+def get_row_sizes(rows):
+    return [row.count(',') + 1 for row in rows]
+
+
+def get_repetitions(row_indices, row_sizes):
+    """
+    Get repetitions of experiments of values of rows, i.e. indices of their rows in the result file, which pair
+    values of the same repetitions in files of different methods
+    """
+    return np.repeat(np.asarray(row_indices, dtype=np.int64), row_sizes)
+
+
+def agg_row(data_file_path, rows_number=ROWS_NUMBER):
+    text, row_indices, row_sizes = read_rows_text(data_file_path, False, rows_number)
+    values = parse_rows(text, data_file_path)
+    check_single_integers(values, len(row_indices), data_file_path)
+    return values, get_repetitions(row_indices, row_sizes)
+
+
+def agg_rowcol(data_file_path, rows_number=ROWS_NUMBER):
+    text, row_indices, row_sizes = read_rows_text(data_file_path, True, rows_number)
+    return parse_rows(text, data_file_path), get_repetitions(row_indices, row_sizes)
+
+
+def skips_na(data_type):
+    """
+    Whether rows containing NA are skipped in files of the data type, numbers of found solutions have no NA
+    """
+    return data_type is not DataType.found_solution_number
+
+
+def get_agg_func(data_type, rows_number=ROWS_NUMBER):
+    """
+    :param rows_number: number of rows to read from every file, all rows if None
+    :return: function reading values of a file and their repetitions
+    """
+    agg_func = agg_rowcol if skips_na(data_type) else agg_row
+    return agg_func if rows_number == ROWS_NUMBER else functools.partial(agg_func, rows_number=rows_number)
+
+
 class DataType(Enum):
     found_solution_number = "percentage of consistent decision scenarios"
     eps = "difference in values of reference alternatives"
@@ -66,7 +316,18 @@ class DataType(Enum):
             return "new-necessary"
 
 
-class MethodType(Enum):
+# data types of results of robustness experiments, which are run only for numbers of pairwise comparisons
+ROBUSTNESS_DATA_TYPES = [DataType.relations_number, DataType.new_relations_number]
+
+
+def select_data_types(data_types=None):
+    """
+    Get data types in the order of DataType, only the given ones if any are given
+    """
+    return [data_type for data_type in DataType if data_types is None or data_type in data_types]
+
+
+class MethodType(str, Enum):
     equal_freq = 'EFB'   # 'EF'
     equal_width = 'EWB'  # 'EW'
     ghaderi = 'SSP'      # 'GH'
@@ -76,23 +337,23 @@ class MethodType(Enum):
     @staticmethod
     def get_ordered():
         return [
-            str(MethodType.equal_freq),
-            str(MethodType.equal_width),
-            str(MethodType.ghaderi),
-            str(MethodType.kernel),
-            str(MethodType.kmeans)
+            MethodType.equal_freq.value,
+            MethodType.equal_width.value,
+            MethodType.ghaderi.value,
+            MethodType.kernel.value,
+            MethodType.kmeans.value
         ]
 
 
-class DistributionType(Enum):
+class DistributionType(str, Enum):
     skew_normal = "skew normal"
     uniform = "uniform"
 
     @staticmethod
     def get_ordered():
         return [
-            str(DistributionType.uniform),
-            str(DistributionType.skew_normal)
+            DistributionType.uniform.value,
+            DistributionType.skew_normal.value
         ]
 
 
@@ -113,6 +374,14 @@ class PathInterpreter:
         self.base_path = base_path
 
     def interpret(self, path):
+        """
+        :param path: path relative to the base path, or a ShardedFile given by its path relative to merged results
+        :return: DataUnit, None if the path is not a result file
+        """
+        if isinstance(path, ShardedFile):
+            sharded_file, path = path, path.relative_path
+        else:
+            sharded_file = None
         path_parts = path.split('/')
 
         data_type = self.get_data_type_name(path_parts[4])
@@ -126,7 +395,7 @@ class PathInterpreter:
         char_points = int(path_parts[3][len('SEGMENTED-')]) if path_parts[3].startswith('SEGMENTED-')\
             else path_parts[3].lower()
         method_id = path_parts[3][len('SEGMENTED-N-'):] if path_parts[3].startswith('SEGMENTED-') else None
-        path = os.path.join(self.base_path, path)
+        path = sharded_file or os.path.join(self.base_path, path)
 
         return DataUnit(data_type, distribution, crit_number, alt_number, pref_info, char_points,
                         self.get_method_name(method_id), path)
@@ -150,6 +419,7 @@ class PathInterpreter:
             return DistributionType.uniform
 
     def get_data_type_name(self, data_type_id):
+        data_type_id = strip_compression_suffix(data_type_id)
         if data_type_id == 'foundsolutionsnumber.csv':
             return DataType.found_solution_number
         elif data_type_id == 'epsvalues.csv':
@@ -160,111 +430,813 @@ class PathInterpreter:
             return DataType.new_relations_number
 
 
-class Aggregator:
+class Sampling:
+    """
+    Stratified sample of configurations of experiments, for previews of results.
+
+    A configuration is a matrix size of a stratum of distribution, preference information and characteristic
+    points, so every series of every chart keeps values for all labels of these dimensions. Matrix sizes are the
+    sampled dimension, so they are not part of strata, and charts by numbers of criteria or alternatives show only
+    the sizes sampled in some stratum. A fraction of configurations of every stratum, at least two of them
+    if the stratum has as many, is drawn at random once, and all result files of the sampled configurations,
+    of all methods and data types, are read as by aggregations.
+    """
+    STRATA_KEYS = ['distribution', 'pref_info', 'char_points']
+    CONFIGURATION_KEYS = STRATA_KEYS + ['crit_number', 'alt_number']
+
+    def __init__(self, fraction, seed=PREVIEW_SEED):
+        """
+        :param fraction: fraction of configurations of every stratum which is read
+        :param seed: seed of the random draw of configurations
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError('Fraction of sampled configurations must be in (0, 1]: %s' % fraction)
+        self.fraction = fraction
+        self.seed = seed
+        # numbers of configurations and sampled configurations by stratum, known once files were selected
+        self.strata = OrderedDict()
+        self.sampled_files_fraction = None
+
+    def select(self, data_path, files_paths):
+        """
+        Walk files once and yield the files of sampled configurations, files are read by the caller as they are
+        yielded
+        :param files_paths: paths of files relative to data_path, or ShardedFile
+        :return: generator of paths of sampled files, in the order of files_paths
+        """
+        interpreter = PathInterpreter(data_path)
+        files_by_configuration = OrderedDict()
+        for file_idx, file_path in enumerate(files_paths):
+            data_unit = interpreter.interpret(file_path)
+            if data_unit is not None:
+                configuration = tuple(getattr(data_unit, key) for key in self.CONFIGURATION_KEYS)
+                files_by_configuration.setdefault(configuration, []).append((file_idx, file_path))
+        configurations_by_stratum = OrderedDict()
+        for configuration in files_by_configuration:
+            configurations_by_stratum.setdefault(configuration[:len(self.STRATA_KEYS)], []).append(configuration)
+
+        random_state = np.random.RandomState(self.seed)
+        self.strata.clear()
+        sampled_files = []
+        for stratum, configurations in configurations_by_stratum.iteritems():
+            sampled_number = max(min(2, len(configurations)), int(round(self.fraction * len(configurations))))
+            sampled_configurations = [configurations[configuration_idx] for configuration_idx in
+                                      sorted(random_state.choice(len(configurations), sampled_number, replace=False))]
+            self.strata[stratum] = (len(configurations), sampled_configurations)
+            for configuration in sampled_configurations:
+                sampled_files.extend(files_by_configuration[configuration])
+        files_number = sum(len(files) for files in files_by_configuration.itervalues())
+        self.sampled_files_fraction = len(sampled_files) / float(files_number) if files_number else 0.0
+        instrumentation.count('sampled_files', len(sampled_files))
+        for _, file_path in sorted(sampled_files):
+            yield file_path
+
+    def get_configurations(self):
+        """
+        :return: sampled configurations, as tuples of labels of CONFIGURATION_KEYS, in the order of strata
+        """
+        return [configuration for _, configurations in self.strata.itervalues() for configuration in configurations]
+
+    def get_note(self, confidence):
+        return 'preview of %.0f%% of result files, %g%% intervals of the sampling error' % (
+            100 * self.sampled_files_fraction, 100 * confidence)
+
+
+class ColumnEncoder:
     def __init__(self):
-        self.by_crit_number = defaultdict(lambda: defaultdict(list))
-        self.by_alt_number = defaultdict(lambda: defaultdict(list))
-        self.by_comparison_number = defaultdict(lambda: defaultdict(list))
-        self.by_distribution = defaultdict(lambda: defaultdict(list))
-
-    def flat_data(self):
-        self._flat([
-            self.by_crit_number,
-            self.by_alt_number,
-            self.by_comparison_number,
-            self.by_distribution
-        ])
-
-    def _flat(self, data_list):
-        for data in data_list:
-            for x, x_dict in data.iteritems():
-                for y, y_list in x_dict.iteritems():
-                    data[x][y] = np.mean(y_list)
-
-
-class AggregatorSumAndCount:
-    def __init__(self):
-        self.by_crit_number = defaultdict(dict)
-        self.by_alt_number = defaultdict(dict)
-        self.by_comparison_number = defaultdict(dict)
-        self.by_distribution = defaultdict(dict)
-        self.by_charact_point = defaultdict(dict)
-
-    def add_by_crit(self, key1, key2, values):
-        self._add(self.by_crit_number, key1, key2, values)
-
-    def add_by_alts(self, key1, key2, values):
-        self._add(self.by_alt_number, key1, key2, values)
-
-    def add_by_comps(self, key1, key2, values):
-        self._add(self.by_comparison_number, key1, key2, values)
-
-    def add_by_distr(self, key1, key2, values):
-        self._add(self.by_distribution, key1, key2, values)
-
-    def add_by_ch_p(self, key1, key2, values):
-        self._add(self.by_charact_point, key1, key2, values)
-
-    def flat_data(self):
-        data_list = [
-            self.by_crit_number,
-            self.by_alt_number,
-            self.by_comparison_number,
-            self.by_distribution,
-            self.by_charact_point
-        ]
-
-        for data in data_list:
-            for x, x_dict in data.iteritems():
-                for y, value_tuple in x_dict.iteritems():
-                    values_sum, count = value_tuple
-                    data[x][y] = float(values_sum) / count
+        self.labels = []
+        self._codes = {}
+
+    def encode(self, label):
+        if label not in self._codes:
+            self._codes[label] = len(self.labels)
+            self.labels.append(label)
+        return self._codes[label]
+
+    def get_code(self, label):
+        return self._codes.get(label)
+
+
+class GrowingArray:
+    """
+    Contiguous numpy buffer, reallocated geometrically as values are appended
+    """
+    def __init__(self, dtype, capacity=1024):
+        self._buffer = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        self._reserve(self._size + 1)
+        self._buffer[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        end = self._size + len(values)
+        self._reserve(end)
+        self._buffer[self._size:end] = values
+        self._size = end
+
+    def get(self):
+        return self._buffer[:self._size]
+
+    def _reserve(self, size):
+        if size > len(self._buffer):
+            buffer = np.empty(max(size, 2 * len(self._buffer)), dtype=self._buffer.dtype)
+            buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
+
+
+class GroupedValues:
+    """
+    Values of many records kept once, in a single contiguous float64 buffer, with the repetition of experiments
+    of every value in a parallel buffer.
+
+    Every record has a dictionary-encoded label for each key. Grouping by any subset of keys sorts records,
+    not values, and selects the values of each group by an index into the shared buffer.
+    """
+    def __init__(self, key_names):
+        self.key_names = key_names
+        self._values = GrowingArray(np.float64)
+        self._repetitions = GrowingArray(np.int64)
+        self._starts = GrowingArray(np.int64)
+        self._sizes = GrowingArray(np.int64)
+        self._codes = dict((key_name, GrowingArray(np.int32)) for key_name in key_names)
+        self._encoders = dict((key_name, ColumnEncoder()) for key_name in key_names)
+        # values of replaced records still taking space in the buffer
+        self._unused_size = 0
+
+    def __len__(self):
+        return len(self._values) - self._unused_size
+
+    def add(self, values, repetitions, *labels):
+        """
+        :param repetitions: repetitions of experiments of the values
+        :return: index of the added record
+        """
+        self._starts.append(len(self._values))
+        self._values.extend(values)
+        self._repetitions.extend(repetitions)
+        self._sizes.append(len(values))
+        for key_name, label in zip(self.key_names, labels):
+            self._codes[key_name].append(self._encoders[key_name].encode(label))
+        return len(self._sizes) - 1
+
+    def replace(self, record, values, repetitions):
+        """
+        Replace values of a record and their repetitions, keeping its labels. Values of another length are appended
+        to the buffer and the space of the previous ones is reclaimed once it is most of the buffer, so the cost
+        of a replacement follows the number of its values.
+        """
+        starts, sizes = self._starts.get(), self._sizes.get()
+        if len(values) == sizes[record]:
+            self._values.get()[starts[record]:starts[record] + sizes[record]] = values
+            self._repetitions.get()[starts[record]:starts[record] + sizes[record]] = repetitions
+            return
+        self._unused_size += sizes[record]
+        starts[record] = len(self._values)
+        sizes[record] = len(values)
+        self._values.extend(values)
+        self._repetitions.extend(repetitions)
+        if self._unused_size > len(self._values) // 2:
+            self._compact()
+
+    def _compact(self):
+        starts, sizes = self._starts.get(), self._sizes.get()
+        ends = np.cumsum(sizes)
+        values_idx = np.repeat(starts - (ends - sizes), sizes) + np.arange(ends[-1])
+        values = self._values.get()[values_idx]
+        repetitions = self._repetitions.get()[values_idx]
+        self._values = GrowingArray(np.float64, max(len(values), 1024))
+        self._values.extend(values)
+        self._repetitions = GrowingArray(np.int64, max(len(repetitions), 1024))
+        self._repetitions.extend(repetitions)
+        starts[:] = ends - sizes
+        self._unused_size = 0
+
+    def get_labels(self, key_name):
+        return list(self._encoders[key_name].labels)
+
+    def get_codes(self, key_name):
+        return self._codes[key_name].get()
+
+    def group(self, key_names, records=None, repetitions=False):
+        """
+        Group values by labels of the given keys.
+        Groups are ordered by the codes of labels, values in a group keep the order in which they were added.
+        :param key_names: names of keys grouping the values
+        :param records: sorted indices of records to group, all records by default
+        :param repetitions: whether repetitions of the values are grouped together with them
+        :return: OrderedDict of numpy.ndarray, or of (values, repetitions) tuples if repetitions is set,
+            by tuple of labels
+        """
+        labels, values_idx, group_starts = self._sort_by_groups(key_names, records)
+        values = self._values.get()[values_idx]
+        group_ends = np.append(group_starts[1:], len(values))
+        if repetitions:
+            values_repetitions = self._repetitions.get()[values_idx]
+            return OrderedDict((group_labels, (values[start:end], values_repetitions[start:end]))
+                               for group_labels, start, end in zip(labels, group_starts, group_ends))
+        return OrderedDict((group_labels, values[start:end])
+                           for group_labels, start, end in zip(labels, group_starts, group_ends))
+
+    def means(self, key_names, records=None):
+        """
+        Compute means of groups of values, grouped as by group. Groups are formed with a single sort of records,
+        only the means are computed group by group, with the pairwise summation of numpy.mean.
+        :return: OrderedDict of means by tuple of labels
+        """
+        return OrderedDict((group_labels, np.mean(values))
+                           for group_labels, values in self.group(key_names, records).iteritems())
+
+    def mean_intervals(self, key_names, bootstrap, records=None):
+        """
+        Compute bootstrap confidence intervals of means of groups of values, grouped as by group
+        :type bootstrap: Bootstrap
+        :return: OrderedDict of (low, high) tuples by tuple of labels
+        """
+        labels, values_idx, group_starts = self._sort_by_groups(key_names, records)
+        lows, highs = bootstrap.get_intervals(self._values.get()[values_idx], group_starts)
+        return OrderedDict(zip(labels, zip(lows, highs)))
+
+    def mean_sampling_intervals(self, key_names, bootstrap, records=None):
+        """
+        Compute confidence intervals of means of groups of values for the error of sampling configurations
+        of a preview, grouped as by group
+        :type bootstrap: SamplingBootstrap
+        :return: OrderedDict of (low, high) tuples by tuple of labels
+        """
+        labels, values_idx, starts = self._sort_by_groups(key_names + Sampling.CONFIGURATION_KEYS, records)
+        counts = np.diff(np.append(starts, len(values_idx)))
+        # reduceat needs groups with values, empty groups have no sums
+        non_empty = counts > 0
+        sums = np.zeros(len(counts))
+        sums[non_empty] = np.add.reduceat(self._values.get()[values_idx], starts[non_empty])
+        # labels of a sum are those of its group followed by those of its configuration
+        keys_number = len(key_names)
+        group_codes = OrderedDict()
+        for sum_labels in labels:
+            group_codes.setdefault(sum_labels[:keys_number], len(group_codes))
+        lows, highs = bootstrap.get_intervals([sum_labels[keys_number:] for sum_labels in labels],
+                                              [group_codes[sum_labels[:keys_number]] for sum_labels in labels],
+                                              sums, counts, len(group_codes))
+        return OrderedDict(zip(group_codes, zip(lows, highs)))
+
+    def _sort_by_groups(self, key_names, records):
+        """
+        Sort values by groups of records with the same labels of the given keys
+        :return: labels of groups, indices of sorted values in the buffer and starts of groups in the sorted values
+        """
+        sizes = self._sizes.get()
+        starts = self._starts.get()
+        codes = [self._codes[key_name].get() for key_name in key_names]
+        if records is not None:
+            sizes, starts = sizes[records], starts[records]
+            codes = [key_codes[records] for key_codes in codes]
+        if len(sizes) == 0:
+            return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # lexsort is stable, so records of a group stay in the order in which they were added
+        records_order = np.lexsort(codes[::-1])
+        ordered_sizes = sizes[records_order]
+        values_ends = np.cumsum(ordered_sizes)
+        values_starts = values_ends - ordered_sizes
+        values_idx = np.repeat(starts[records_order] - values_starts, ordered_sizes) + np.arange(values_ends[-1])
+
+        ordered_codes = np.vstack([key_codes[records_order] for key_codes in codes])
+        group_starts = np.concatenate([[0], np.flatnonzero(np.any(np.diff(ordered_codes, axis=1), axis=0)) + 1])
+        labels = [tuple(self._encoders[key_name].labels[key_codes[start]]
+                        for key_name, key_codes in zip(key_names, ordered_codes))
+                  for start in group_starts]
+        return labels, values_idx, values_starts[group_starts]
+
+
+class Bootstrap:
+    """
+    Percentile bootstrap confidence intervals of means of many groups of values, computed for all groups at once.
+
+    Every batch of resamples draws indices of values within their groups for all values of all groups together,
+    as a matrix of a row for every resample, and sums the drawn values of every group with a single reduceat.
+    Batches are sized so that one batch draws about batch_values values.
+    """
+    def __init__(self, resamples=BOOTSTRAP_RESAMPLES, confidence=BOOTSTRAP_CONFIDENCE, seed=0,
+                 batch_values=BOOTSTRAP_BATCH_VALUES):
+        self.resamples = resamples
+        self.confidence = confidence
+        self.seed = seed
+        self.batch_values = batch_values
+
+    def get_intervals(self, values, group_starts):
+        """
+        :param values: values of all groups, ordered by groups
+        :param group_starts: starts of groups in values
+        :return: lower and upper bounds of intervals, as numpy.ndarray of a value for every group
+        """
+        counts = np.diff(np.append(group_starts, len(values)))
+        intervals = np.full((2, len(counts)), np.nan)
+        # reduceat needs groups with values, empty groups have no intervals
+        non_empty = counts > 0
+        starts, counts = group_starts[non_empty], counts[non_empty]
+        means = np.empty((self.resamples, len(counts)))
+        if len(counts):
+            value_groups = np.repeat(np.arange(len(counts)), counts)
+            value_starts = starts[value_groups].astype(np.float64)
+            value_counts = counts[value_groups].astype(np.float64)
+            # the same seed gives the same intervals, so charts do not change between runs
+            random_state = np.random.RandomState(self.seed)
+            batch_size = max(1, self.batch_values // len(values))
+            for batch_start in xrange(0, self.resamples, batch_size):
+                batch_end = min(batch_start + batch_size, self.resamples)
+                drawn_idx = random_state.random_sample((batch_end - batch_start, len(values)))
+                drawn_idx *= value_counts
+                drawn_idx += value_starts
+                sums = np.add.reduceat(values[drawn_idx.astype(np.intp)], starts, axis=1)
+                means[batch_start:batch_end] = sums / counts
+            alpha = (1 - self.confidence) / 2
+            intervals[:, non_empty] = np.percentile(means, [100 * alpha, 100 * (1 - alpha)], axis=0)
+        return intervals
+
+
+class SamplingBootstrap:
+    """
+    Confidence intervals of means of a preview for the error of sampling configurations of experiments.
+
+    Sampled configurations are clusters of values resampled within their strata, with the rescaling bootstrap of
+    Rao and Wu: a resample draws n - 1 of the n sampled configurations of a stratum with replacement, and weights
+    of configurations are rescaled so that means vary as means of samples without replacement of the fraction
+    of configurations read, strata read whole do not vary. Weights of resamples are drawn once for all charts,
+    and means of a resample are weighted sums of values of configurations divided by their weighted counts.
+    """
+    def __init__(self, sampling, resamples=BOOTSTRAP_RESAMPLES, confidence=BOOTSTRAP_CONFIDENCE, seed=0):
+        """
+        :type sampling: Sampling
+        """
+        self.sampling = sampling
+        self.resamples = resamples
+        self.confidence = confidence
+        self.seed = seed
+        self._weights = None
+        self._configuration_columns = None
+
+    def get_intervals(self, configurations, group_codes, sums, counts, groups_number):
+        """
+        :param configurations: configurations of sums, as tuples of labels of Sampling.CONFIGURATION_KEYS
+        :param group_codes: groups of sums
+        :param sums: sums of values of a group in a configuration
+        :param counts: numbers of summed values
+        :return: lower and upper bounds of intervals, as numpy.ndarray of a value for every group
+        """
+        weights = self._get_weights()
+        cells = ([self._configuration_columns[configuration] for configuration in configurations], group_codes)
+        configuration_sums = np.zeros((weights.shape[1], groups_number))
+        configuration_counts = np.zeros((weights.shape[1], groups_number))
+        np.add.at(configuration_sums, cells, sums)
+        np.add.at(configuration_counts, cells, counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.dot(weights, configuration_sums) / np.dot(weights, configuration_counts)
+        alpha = (1 - self.confidence) / 2
+        return np.percentile(means, [100 * alpha, 100 * (1 - alpha)], axis=0)
+
+    def _get_weights(self):
+        """
+        Weights of sampled configurations in every resample, drawn once configurations were sampled
+        :return: numpy.ndarray of a row for every resample and a column for every sampled configuration
+        """
+        if self._weights is None:
+            # the same seed gives the same intervals, so charts do not change between runs
+            random_state = np.random.RandomState(self.seed)
+            strata_weights = [np.ones((self.resamples, 0))]
+            for configurations_number, configurations in self.sampling.strata.itervalues():
+                sampled_number = len(configurations)
+                if sampled_number < 2:
+                    strata_weights.append(np.ones((self.resamples, sampled_number)))
+                    continue
+                draws = random_state.multinomial(sampled_number - 1, [1.0 / sampled_number] * sampled_number,
+                                                 self.resamples)
+                scale = np.sqrt(1 - sampled_number / float(configurations_number))
+                strata_weights.append(1 - scale + scale * sampled_number / (sampled_number - 1.0) * draws)
+            self._weights = np.hstack(strata_weights)
+            self._configuration_columns = dict((configuration, column) for column, configuration
+                                               in enumerate(self.sampling.get_configurations()))
+        return self._weights
+
+
+class DimensionIndex:
+    """
+    Records of every label of a dimension, kept as record indices sorted by label code
+    """
+    def __init__(self, codes, labels_number):
+        self.records = np.argsort(codes, kind='mergesort')
+        self.bounds = np.searchsorted(codes[self.records], np.arange(labels_number + 1))
+
+    def count(self, label_codes):
+        return sum(self.bounds[code + 1] - self.bounds[code] for code in label_codes)
+
+    def get_records(self, label_codes):
+        if not label_codes:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate([self.records[self.bounds[code]:self.bounds[code + 1]]
+                                       for code in label_codes]))
+
+
+class ResultsTable:
+    """
+    Values of all result files together with their parameters, loaded once from the results tree.
+
+    Every parameter of DataUnit is a dictionary-encoded dimension column with an index of records by label,
+    built on first use. Queries filter records with the indexes and group them with a single sort, e.g.
+    mean eps by method and number of alternatives for the skew normal distribution and 5 characteristic points:
+    table.mean(['method_name', 'alt_number'], where={'data_type': DataType.eps,
+                                                     'distribution': DistributionType.skew_normal, 'char_points': 5})
+    """
+    DIMENSIONS = ['data_type', 'distribution', 'crit_number', 'alt_number', 'pref_info', 'char_points', 'method_name']
 
-    def _add(self, values_dict, key1, key2, values):
-        sum_to_add = sum(values)
-        if key2 not in values_dict[key1]:
-            values_dict[key1][key2] = (sum_to_add, len(values))
+    def __init__(self):
+        self.values = GroupedValues(self.DIMENSIONS)
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, data_unit, values, repetitions):
+        """
+        :param repetitions: repetitions of experiments of the values, i.e. indices of their rows in the result file
+        :return: index of the added record
+        """
+        record = self.values.add(values, repetitions,
+                                 *[getattr(data_unit, dimension) for dimension in self.DIMENSIONS])
+        if self._indexes:
+            self._indexes = {}
+        return record
+
+    def replace(self, record, values, repetitions):
+        """
+        Replace values of a record and their repetitions, e.g. of a file which got new rows, indexes of labels
+        stay valid
+        """
+        self.values.replace(record, values, repetitions)
+
+    def select(self, where=None):
+        """
+        Find records matching all conditions
+        :param where: conditions by dimension, a condition is a label, a list of labels or a function of a label
+        :return: sorted indices of the records, None if there are no conditions
+        """
+        if not where:
+            return None
+        label_codes = dict((dimension, self._get_label_codes(dimension, condition))
+                           for dimension, condition in where.iteritems())
+        # records of the most selective condition are taken from its index, other conditions are checked on them
+        first_dimension = min(label_codes, key=lambda dimension: self._get_index(dimension).count(
+            label_codes[dimension]))
+        records = self._get_index(first_dimension).get_records(label_codes[first_dimension])
+        for dimension, codes in label_codes.iteritems():
+            if dimension != first_dimension:
+                records = records[np.in1d(self.values.get_codes(dimension)[records], codes)]
+        return records
+
+    def get_labels(self, dimension, where=None):
+        """
+        Get labels of a dimension present in records matching the conditions, in the order in which they were added
+        """
+        labels = self.values.get_labels(dimension)
+        codes = self.values.get_codes(dimension)
+        records = self.select(where)
+        return [labels[code] for code in np.unique(codes if records is None else codes[records])]
+
+    def group(self, by, where=None, repetitions=False):
+        """
+        Group values of records matching the conditions by labels of the given dimensions
+        :param repetitions: whether repetitions of the values are grouped together with them
+        :return: OrderedDict of numpy.ndarray, or of (values, repetitions) tuples if repetitions is set,
+            by tuple of labels
+        """
+        return self.values.group(by, self.select(where), repetitions)
+
+    def mean(self, by, where=None):
+        """
+        Compute means of values of records matching the conditions, grouped by labels of the given dimensions
+        :return: OrderedDict of means by tuple of labels
+        """
+        return self.values.means(by, self.select(where))
+
+    def mean_intervals(self, by, bootstrap, where=None):
+        """
+        Compute bootstrap confidence intervals of means of values of records matching the conditions,
+        grouped by labels of the given dimensions
+        :param bootstrap: bootstrap of values, or of sampled configurations of a preview
+        :type bootstrap: Bootstrap or SamplingBootstrap
+        :return: OrderedDict of (low, high) tuples by tuple of labels
+        """
+        if isinstance(bootstrap, SamplingBootstrap):
+            return self.values.mean_sampling_intervals(by, bootstrap, self.select(where))
+        return self.values.mean_intervals(by, bootstrap, self.select(where))
+
+    def _get_label_codes(self, dimension, condition):
+        labels = self.values.get_labels(dimension)
+        if callable(condition):
+            return [code for code, label in enumerate(labels) if condition(label)]
+        accepted_labels = condition if isinstance(condition, list) else [condition]
+        return [code for code, label in enumerate(labels) if label in accepted_labels]
+
+    def _get_index(self, dimension):
+        if dimension not in self._indexes:
+            self._indexes[dimension] = DimensionIndex(self.values.get_codes(dimension),
+                                                      len(self.values.get_labels(dimension)))
+        return self._indexes[dimension]
+
+
+def is_segmented(char_points):
+    return not isinstance(char_points, str)
+
+
+def format_label(label):
+    return label.name if isinstance(label, Enum) else str(label)
+
+
+def format_chart_label(label):
+    """
+    Format a label as it is shown on charts, enumerations by value
+    """
+    return label.value if isinstance(label, Enum) else str(label)
+
+
+def get_label_sort_key(label):
+    # numbers go first, in numerical order
+    return (0, label, '') if isinstance(label, (int, long, float)) else (1, 0, format_label(label))
+
+
+def get_chart_label_sort_key(label):
+    return get_label_sort_key(label if isinstance(label, (int, long, float)) else format_chart_label(label))
+
+
+def parse_label(dimension, text):
+    """
+    Parse a label of a dimension given as text, enumerations by name or by value
+    """
+    enum_types = {'data_type': DataType, 'distribution': DistributionType, 'method_name': MethodType}
+    if dimension in enum_types:
+        for member in enum_types[dimension]:
+            if text in (member.name, member.value):
+                return member
+        raise ValueError('Unknown label of %s: %s' % (dimension, text))
+    return int(text) if text.isdigit() else text
+
+
+def get_x_values(data):
+    x_values = set()
+    for series_name, series_data in data.iteritems():
+        x_values.update(series_data.keys())
+    return list(x_values)
+
+
+def _get_canonical_form(value):
+    if isinstance(value, dict):
+        return sorted((repr(key), _get_canonical_form(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_get_canonical_form(item) for item in value]
+    return repr(value)
+
+
+class Chart:
+    """
+    Plain description of a chart: its series, labels and style.
+    Charts are rendered by render_chart, possibly in another process.
+    """
+    def __init__(self, path, kind, data, x_label, y_label, series_order=None, columns=None, index=None, ylim=None,
+                 xticks=None, xtickslabels=None, linewidth=2, errors=None, note=None):
+        """
+        :param path: output path of the chart
+        :param kind: 'line' or 'bar'
+        :param data: dict of series, each series is a dict of values by x value
+        :param errors: confidence intervals of values, as data with (low, high) tuples instead of values,
+            plotted as error bars
+        :param series_order: series to plot, in the given order
+        :param columns: columns of the data frame created from data
+        :param index: index of the data frame created from data
+        :param note: text shown above the chart
+        """
+        self.path = path
+        self.kind = kind
+        self.data = dict((series_name, dict(series_data)) for series_name, series_data in data.iteritems())
+        self.x_label = x_label
+        self.y_label = str(y_label)
+        self.series_order = series_order
+        self.columns = columns
+        self.index = index
+        self.ylim = ylim
+        self.xticks = xticks
+        self.xtickslabels = xtickslabels
+        self.linewidth = linewidth
+        self.errors = dict((series_name, dict(series_errors)) for series_name, series_errors in errors.iteritems()) \
+            if errors is not None else None
+        self.note = note
+        self.legend = LEGEND
+        self.font_size = FONT_SIZE
+        self.line_styles = LINE_STYLES
+
+    def get_hash(self):
+        """
+        Hash of everything the chart is rendered from except its path
+        """
+        attributes = dict((name, value) for name, value in vars(self).iteritems() if name != 'path')
+        return hashlib.sha1(repr(_get_canonical_form(attributes))).hexdigest()
+
+    def get_table_path(self):
+        return '%s.csv' % os.path.splitext(self.path)[0]
+
+    def save_table(self):
+        """
+        Save values of the chart and their confidence intervals as CSV, a row for every value, labelled as on the chart
+        """
+        with open(self.get_table_path(), 'w') as output_file:
+            output_file.write('series,x,mean,ci_low,ci_high\n')
+            for series_name in sorted(self.data, key=get_chart_label_sort_key):
+                series_errors = self.errors.get(series_name, {})
+                for x in sorted(self.data[series_name], key=get_chart_label_sort_key):
+                    low, high = series_errors.get(x, (np.nan, np.nan))
+                    output_file.write('%s,%s,%f,%f,%f\n' % (format_chart_label(series_name), format_chart_label(x),
+                                                             self.data[series_name][x], low, high))
+
+
+def render_chart(chart):
+    # plotting libraries take most of the start-up time, so they are imported only when a chart is rendered
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    matplotlib.rcParams.update({'font.size': chart.font_size})
+    df = pd.DataFrame(chart.data, index=chart.index, columns=chart.columns)
+    if chart.series_order:
+        # series may be missing when only a part of the results is read
+        df = df[[series_name for series_name in chart.series_order if series_name in df.columns]]
+    if chart.errors is not None:
+        errors = pd.DataFrame(chart.errors).reindex(index=df.index, columns=df.columns)
+        lows = errors.applymap(lambda interval: interval[0] if isinstance(interval, tuple) else np.nan)
+        highs = errors.applymap(lambda interval: interval[1] if isinstance(interval, tuple) else np.nan)
+    if chart.kind == 'bar':
+        if chart.errors is not None:
+            # asymmetric error bars of every series, as distances of bounds from the values
+            ax = df.plot(kind='bar', yerr=np.array([[df[name] - lows[name], highs[name] - df[name]]
+                                                    for name in df.columns]))
         else:
-            values_sum, count = values_dict[key1][key2]
-            values_dict[key1][key2] = (values_sum + sum_to_add, count + len(values))
+            ax = df.plot(kind='bar')
+        ax.yaxis.grid()
+    else:
+        ax = df.plot(style=chart.line_styles, clip_on=False, markersize=15, linewidth=chart.linewidth)
+        if chart.errors is not None:
+            for name, line in zip(df.columns, ax.get_lines()):
+                ax.errorbar(df.index, df[name], yerr=[df[name] - lows[name], highs[name] - df[name]], fmt='none',
+                            ecolor=line.get_color(), capsize=4, clip_on=False)
+    ax.set_xlabel(chart.x_label)
+    ax.set_ylabel(chart.y_label)
+    if chart.note:
+        ax.set_title(chart.note)
+    if chart.ylim:
+        ax.set_ylim(chart.ylim)
+    if chart.xticks:
+        ax.set_xticks(chart.xticks)
+    if chart.xtickslabels:
+        ax.set_xticklabels(chart.xtickslabels)
+    if chart.legend:
+        box = ax.get_position()
+        ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
+        ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+    else:
+        ax.legend().set_visible(False)
+    if chart.kind == 'bar':
+        locs, labels = plt.xticks()
+        plt.setp(labels, rotation=0)
+    plt.savefig(chart.path, bbox_inches='tight')
+    plt.close()
+    return chart.path
+
+
+class ChartRenderer:
+    """
+    Renders charts in a pool of processes.
+
+    Hashes of rendered charts are kept in an index file in every output directory. A chart whose hash did not change
+    since the previous run is not rendered again, as long as its file still exists, rendered and unchanged charts
+    are counted in metrics. Tables of charts with
+    confidence intervals are cheap, so they are saved every time.
+    """
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._indexes = {}
+
+    def render(self, charts):
+        charts_to_render = {}
+        for chart in charts:
+            if chart.errors is not None:
+                chart.save_table()
+            chart_hash = chart.get_hash()
+            if self._get_index(chart.path).get(os.path.basename(chart.path)) == chart_hash and \
+                    os.path.exists(chart.path):
+                continue
+            charts_to_render[chart.path] = (chart, chart_hash)
+
+        try:
+            for chart_path in self._imap(render_chart, [chart for chart, _ in charts_to_render.itervalues()]):
+                self._get_index(chart_path)[os.path.basename(chart_path)] = charts_to_render[chart_path][1]
+        finally:
+            self._save_indexes()
+        instrumentation.count('charts_rendered', len(charts_to_render))
+        instrumentation.count('charts_unchanged', len(charts) - len(charts_to_render))
+        print 'Rendered charts: %d, unchanged charts: %d' % (len(charts_to_render), len(charts) - len(charts_to_render))
+
+    def _imap(self, func, args_list):
+        if self.workers <= 1 or len(args_list) <= 1:
+            for args in args_list:
+                yield func(args)
+            return
+        pool = multiprocessing.Pool(min(self.workers, len(args_list)))
+        try:
+            for result in pool.imap_unordered(func, args_list):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _get_index(self, chart_path):
+        index_path = os.path.join(os.path.dirname(chart_path), CHARTS_INDEX_FILE)
+        if index_path not in self._indexes:
+            index = {}
+            if os.path.exists(index_path):
+                with open(index_path, 'r') as index_file:
+                    index = json.load(index_file)
+            self._indexes[index_path] = index
+        return self._indexes[index_path]
+
+    def _save_indexes(self):
+        for index_path, index in self._indexes.iteritems():
+            write_json_atomically(index_path, index)
 
 
 class DataAggregation:
-    def __init__(self, output_path):
+    def __init__(self, output_path, bootstrap=None):
+        """
+        :param bootstrap: bootstrap of confidence intervals of plotted means, none are computed if not given
+        :type bootstrap: Bootstrap
+        """
         self.output_path = output_path
-
-    def add_data(self, data):
+        self.bootstrap = bootstrap
+
+    def query(self, table, by, where):
+        """
+        Compute means of values grouped by the given dimensions and their confidence intervals if bootstrapped
+        :type table: ResultsTable
+        :return: means by tuple of labels and (low, high) intervals by tuple of labels, or None
+        """
+        intervals = table.mean_intervals(by, self.bootstrap, where) if self.bootstrap is not None else None
+        return table.mean(by, where), intervals
+
+    def generate_results(self, table, data_types=None):
+        """
+        Query the results table, save results which do not need rendering and describe the charts to render
+        :type table: ResultsTable
+        :param data_types: data types whose results are generated, all data types by default
+        :return: list of Chart
+        """
         raise NotImplementedError()
 
 
+def get_series_data(values, skipped_keys=(), get_series=None, get_x=None):
+    """
+    Convert values grouped by (series, x) into a dict of values by x, by series
+    :param skipped_keys: x values to skip
+    :param get_series: function converting labels into series names
+    :param get_x: function converting labels into x values
+    :return: dict of dicts, None if values are None
+    """
+    if values is None:
+        return None
+    data = defaultdict(dict)
+    for (series, x), value in values.iteritems():
+        if x not in skipped_keys:
+            data[get_series(series) if get_series else series][get_x(x) if get_x else x] = value
+    return data
+
+
 class AggregationByCharPoints(DataAggregation):
-    def __init__(self, output_path):
+    def __init__(self, output_path, bootstrap=None):
         output_dir = os.path.join(output_path, 'charac-points')
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        DataAggregation.__init__(self, output_dir)
-        self.aggregators = {
-            DataType.found_solution_number: Aggregator(),
-            DataType.eps: Aggregator(),
-            DataType.relations_number: Aggregator(),
-            DataType.new_relations_number: Aggregator()
-        }
+        DataAggregation.__init__(self, output_dir, bootstrap)
 
-    def add_data(self, data):
-        if data.method_name is None or data.method_name == MethodType.equal_width:
-            aggregator = self.aggregators[data.data_type]
-            agg_func = agg_row if data.data_type == DataType.found_solution_number else agg_rowcol
+    def generate_results(self, table, data_types=None):
+        return self.generate_charts(table, data_types)
 
-            ch_point_str = data.char_points if isinstance(data.char_points, str) else '%d char. p.' % data.char_points
-
-            aggregator.by_crit_number[ch_point_str][data.crit_number].extend(agg_func(data.path))
-            aggregator.by_alt_number[ch_point_str][data.alt_number].extend(agg_func(data.path))
-            if data.pref_info != 'ranking':
-                aggregator.by_comparison_number[ch_point_str][data.pref_info].extend(agg_func(data.path))
-            aggregator.by_distribution[ch_point_str][data.distribution].extend(agg_func(data.path))
-
-    def generate_charts(self):
-        for data_type, aggregator in self.aggregators.iteritems():
+    def generate_charts(self, table, data_types=None):
+        charts = []
+        for data_type in select_data_types(data_types):
             ylim = None
             if data_type is DataType.found_solution_number:
                 ylim = (0, 100)
@@ -274,93 +1246,51 @@ class AggregationByCharPoints(DataAggregation):
                 ylim = (0, 50)
             if data_type is DataType.new_relations_number:
                 ylim = (0, 35)
-            aggregator.flat_data()
+            where = {'data_type': data_type, 'method_name': [None, MethodType.equal_width]}
             data_type_code = DataType.get_code(data_type)
             series_order = ['linear', '3 char. p.', '4 char. p.', '5 char. p.', '6 char. p.', 'general']
-            self._plot_chart('crits-%s' % data_type_code, aggregator.by_crit_number,
-                             x_label='number of criteria', y_label=data_type, series_order=series_order, ylim=ylim)
-            self._plot_chart('alts-%s' % data_type_code, aggregator.by_alt_number,
-                             x_label='number of alternatives', y_label=data_type, series_order=series_order, ylim=ylim)
-            self._plot_chart('comps-%s' % data_type_code, aggregator.by_comparison_number,
-                             x_label='number of pairwise comparisons', y_label=data_type,
-                             series_order=series_order, ylim=ylim)
-            self._plot_bar_chart('distr-%s' % data_type_code, aggregator.by_distribution,
-                                 x_label='performance distribution', y_label=data_type, series_order=series_order, ylim=ylim)
-
-    def _plot_bar_chart(self, output_name, data, x_label, y_label, series_order=None, ylim=None):
-        df = pd.DataFrame(data)
-        if series_order:
-            df = df[series_order]
-        ax = df.plot(kind='bar')
-        ax.yaxis.grid()
-        ax.set_xlabel(x_label)
-        ax.set_ylabel(y_label)
-        if ylim:
-            ax.set_ylim(ylim)
-        if LEGEND:
-            box = ax.get_position()
-            ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
-            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-        else:
-            ax.legend().set_visible(False)
-        locs, labels = plt.xticks()
-        plt.setp(labels, rotation=0)
-        plt.savefig(os.path.join(self.output_path, '%s.pdf' % output_name), bbox_inches='tight')
-        plt.close()
-
-    def _plot_chart(self, output_name, data, x_label, y_label, set_xticks=True, series_order=None, ylim=None):
-        df = pd.DataFrame(data)
-        if series_order:
-            df = df[series_order]
-        ax = df.plot(style=['x-', '^-', 's-', 'p-', 'h-', 'o-'], clip_on=False, markersize=15, linewidth=3)
-        ax.set_xlabel(x_label)
-        ax.set_ylabel(y_label)
-        if ylim:
-            ax.set_ylim(ylim)
-        if set_xticks:
-            x_values = set()
-            for series_name, series_data in data.iteritems():
-                x_values.update(series_data.keys())
-            ax.set_xticks(list(x_values))
-        if LEGEND:
-            box = ax.get_position()
-            ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
-            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-        else:
-            ax.legend().set_visible(False)
-        plt.savefig(os.path.join(self.output_path, '%s.pdf' % output_name), bbox_inches='tight')
-        plt.close()
+            charts.append(self._line_chart('crits-%s' % data_type_code, self._query(table, 'crit_number', where),
+                                           x_label='number of criteria', y_label=data_type,
+                                           series_order=series_order, ylim=ylim))
+            charts.append(self._line_chart('alts-%s' % data_type_code, self._query(table, 'alt_number', where),
+                                           x_label='number of alternatives', y_label=data_type,
+                                           series_order=series_order, ylim=ylim))
+            charts.append(self._line_chart('comps-%s' % data_type_code,
+                                           self._query(table, 'pref_info', where, skipped_keys=['ranking']),
+                                           x_label='number of pairwise comparisons', y_label=data_type,
+                                           series_order=series_order, ylim=ylim))
+            data, errors = self._query(table, 'distribution', where)
+            charts.append(Chart(os.path.join(self.output_path, 'distr-%s.pdf' % data_type_code), 'bar',
+                                data, x_label='performance distribution', y_label=data_type,
+                                series_order=series_order, ylim=ylim, errors=errors))
+        return charts
+
+    def _query(self, table, dimension, where, skipped_keys=()):
+        return [get_series_data(values, skipped_keys, get_series=self._get_series)
+                for values in self.query(table, ['char_points', dimension], where)]
+
+    def _get_series(self, char_points):
+        return char_points if isinstance(char_points, str) else '%d char. p.' % char_points
+
+    def _line_chart(self, output_name, query_result, x_label, y_label, series_order=None, ylim=None):
+        data, errors = query_result
+        return Chart(os.path.join(self.output_path, '%s.pdf' % output_name), 'line', data, x_label, y_label,
+                     series_order=series_order, ylim=ylim, xticks=get_x_values(data), linewidth=3, errors=errors)
 
 
 class AggregationByMethods(DataAggregation):
-    def __init__(self, output_path):
+    def __init__(self, output_path, bootstrap=None):
         output_dir = os.path.join(output_path, 'methods-comp')
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        DataAggregation.__init__(self, output_dir)
-        self.aggregators = {
-            DataType.found_solution_number: AggregatorSumAndCount(),
-            DataType.eps: AggregatorSumAndCount(),
-            DataType.relations_number: AggregatorSumAndCount(),
-            DataType.new_relations_number: AggregatorSumAndCount(),
-        }
+        DataAggregation.__init__(self, output_dir, bootstrap)
 
-    def add_data(self, data):
-        if not isinstance(data.char_points, str):
-            aggregator = self.aggregators[data.data_type]
+    def generate_results(self, table, data_types=None):
+        return self.generate_charts(table, data_types)
 
-            agg_func = agg_row if data.data_type == DataType.found_solution_number else agg_rowcol
-
-            aggregator.add_by_crit(data.method_name, data.crit_number, agg_func(data.path))
-            aggregator.add_by_alts(data.method_name, data.alt_number, agg_func(data.path))
-            data.pref_info = data.pref_info if data.pref_info != 'ranking' else 10
-            aggregator.add_by_comps(data.method_name, data.pref_info, agg_func(data.path))
-            aggregator.add_by_distr(data.method_name, data.distribution, agg_func(data.path))
-            aggregator.add_by_ch_p(data.method_name, data.char_points, agg_func(data.path))
-
-    def generate_charts(self):
-        for data_type, aggregator in self.aggregators.iteritems():
-            aggregator.flat_data()
+    def generate_charts(self, table, data_types=None):
+        charts = []
+        for data_type in select_data_types(data_types):
             xticks = [2, 4, 6, 8, 10]
             xtickslabels = ['2', '4', '6', '8', 'ranking']
             if data_type == DataType.new_relations_number or data_type == DataType.relations_number:
@@ -375,236 +1305,193 @@ class AggregationByMethods(DataAggregation):
                 ylim = (10, 25)
             if data_type is DataType.new_relations_number:
                 ylim = (0, 8)
+            where = {'data_type': data_type, 'char_points': is_segmented}
+            by_comparison_number = self._query(table, 'pref_info', where,
+                                               get_x=lambda pref_info: pref_info if pref_info != 'ranking' else 10)
             data_type_code = DataType.get_code(data_type)
-            self._plot_chart("crits-%s" % data_type_code, aggregator.by_crit_number,
-                             x_label='number of criteria', y_label=data_type, ylim=ylim)
-            self._plot_chart("alts-%s" % data_type_code, aggregator.by_alt_number,
-                             x_label='number of alternatives', y_label=data_type, ylim=ylim)
-            self._plot_chart("comps-%s" % data_type_code, aggregator.by_comparison_number,
-                             x_label='number of pairwise comparisons',
-                             y_label=data_type, set_xticks=False, xticks=xticks, xtickslabels=xtickslabels, ylim=ylim)
-            self._plot_bar_chart("distr-%s" % data_type_code, aggregator.by_distribution,
-                                 x_label='performance distribution', y_label=data_type, ylim=ylim)
-            self._plot_chart("characp-%s" % data_type_code, aggregator.by_charact_point,
-                             x_label='number of characteristic points', y_label=data_type, ylim=ylim)
-
-    def _plot_bar_chart(self, output_name, data, x_label, y_label, ylim=None):
-        df = pd.DataFrame(data, columns=MethodType.get_ordered())
-        ax = df.plot(kind='bar')
-        ax.yaxis.grid()
-        ax.set_xlabel(x_label)
-        ax.set_ylabel(y_label)
-        if ylim:
-            ax.set_ylim(ylim)
-        if LEGEND:
-            box = ax.get_position()
-            ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
-            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-        else:
-            ax.legend().set_visible(False)
-        locs, labels = plt.xticks()
-        plt.setp(labels, rotation=0)
-        plt.savefig(os.path.join(self.output_path, '%s.pdf' % output_name), bbox_inches='tight')
-        plt.close()
-
-    def _plot_chart(self, output_name, data, x_label, y_label, set_xticks=True, xticks=None, xtickslabels=None,
-                    ylim=None):
-        df = pd.DataFrame(data, columns=MethodType.get_ordered())
-        ax = df.plot(style=['x-', '^-', 's-', 'p-', 'h-', 'o-'], clip_on=False, markersize=15, linewidth=2)
-        ax.set_xlabel(x_label)
-        ax.set_ylabel(y_label)
-        if ylim:
-            ax.set_ylim(ylim)
-        if set_xticks:
-            x_values = set()
-            for series_name, series_data in data.iteritems():
-                x_values.update(series_data.keys())
-            ax.set_xticks(list(x_values))
-        if xticks and xtickslabels:
-            ax.set_xticks(xticks)
-            ax.set_xticklabels(xtickslabels)
-        if LEGEND:
-            box = ax.get_position()
-            ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
-            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-        else:
-            ax.legend().set_visible(False)
-        plt.savefig(os.path.join(self.output_path, '%s.pdf' % output_name), bbox_inches='tight')
-        plt.close()
+            charts.append(self._line_chart("crits-%s" % data_type_code, self._query(table, 'crit_number', where),
+                                           x_label='number of criteria', y_label=data_type, ylim=ylim))
+            charts.append(self._line_chart("alts-%s" % data_type_code, self._query(table, 'alt_number', where),
+                                           x_label='number of alternatives', y_label=data_type, ylim=ylim))
+            charts.append(self._line_chart("comps-%s" % data_type_code, by_comparison_number,
+                                           x_label='number of pairwise comparisons', y_label=data_type,
+                                           xticks=xticks, xtickslabels=xtickslabels, ylim=ylim))
+            data, errors = self._query(table, 'distribution', where)
+            charts.append(Chart(os.path.join(self.output_path, "distr-%s.pdf" % data_type_code), 'bar',
+                                data, x_label='performance distribution', y_label=data_type,
+                                columns=MethodType.get_ordered(), ylim=ylim, errors=errors))
+            charts.append(self._line_chart("characp-%s" % data_type_code, self._query(table, 'char_points', where),
+                                           x_label='number of characteristic points', y_label=data_type, ylim=ylim))
+        return charts
+
+    def _query(self, table, dimension, where, get_x=None):
+        return [get_series_data(values, get_x=get_x) for values in self.query(table, ['method_name', dimension], where)]
+
+    def _line_chart(self, output_name, query_result, x_label, y_label, xticks=None, xtickslabels=None, ylim=None):
+        data, errors = query_result
+        return Chart(os.path.join(self.output_path, '%s.pdf' % output_name), 'line', data, x_label, y_label,
+                     columns=MethodType.get_ordered(), ylim=ylim, xticks=xticks or get_x_values(data),
+                     xtickslabels=xtickslabels, linewidth=2, errors=errors)
 
 
 class SummaryAggregationByMethod(DataAggregation):
-    def __init__(self, output_path):
+    def __init__(self, output_path, bootstrap=None):
         output_dir = os.path.join(output_path, 'general')
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        DataAggregation.__init__(self, output_dir)
-        self.aggregators = {
-            DataType.found_solution_number: defaultdict(lambda: defaultdict(list)),
-            DataType.eps: defaultdict(lambda: defaultdict(list)),
-            DataType.relations_number: defaultdict(lambda: defaultdict(list)),
-            DataType.new_relations_number: defaultdict(lambda: defaultdict(list))
-        }
-
-    def add_data(self, data):
-        if not isinstance(data.char_points, str):
-            aggregator = self.aggregators[data.data_type]
-
-            ch_point_str = '%d char. p.' % data.char_points
-            agg_func = agg_row if data.data_type == DataType.found_solution_number else agg_rowcol
-
-            aggregator[ch_point_str][data.method_name].extend(agg_func(data.path))
-
-    def generate_charts(self):
-        data = defaultdict(dict)
-        for data_type, aggregator in self.aggregators.iteritems():
-            for x, x_dict in aggregator.iteritems():
-                for y, y_list in x_dict.iteritems():
-                    data[x][y] = np.mean(y_list)
-            self._plot_chart(data, x_label='Discretization method', y_label=data_type,  set_xticks=False)
-
-    def _plot_chart(self, data, x_label, y_label, set_xticks=True, xticks=None, xtickslabels=None, ylim=None):
-        df = pd.DataFrame(data, index=MethodType.get_ordered())
-        ax = df.plot(kind='bar')
-        ax.yaxis.grid()
-        ax.set_xlabel(x_label)
-        ax.set_ylabel(y_label)
-        if set_xticks:
-            x_values = set()
-            for series_name, series_data in data.iteritems():
-                x_values.update(series_data.keys())
-            ax.set_xticks(list(x_values))
-        if xticks and xtickslabels:
-            ax.set_xticks(xticks)
-            ax.set_xticklabels(xtickslabels)
-        if ylim is not None:
-            ax.set_ylim(ylim)
-        if LEGEND:
-            box = ax.get_position()
-            ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
-            ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-        else:
-            ax.legend().set_visible(False)
-        locs, labels = plt.xticks()
-        plt.setp(labels, rotation=0)
-        plt.savefig(os.path.join(self.output_path, '%s.pdf' % (DataType.get_code(y_label))), bbox_inches='tight')
-        plt.close()
+        DataAggregation.__init__(self, output_dir, bootstrap)
+
+    def generate_results(self, table, data_types=None):
+        return self.generate_charts(table, data_types)
+
+    def generate_charts(self, table, data_types=None):
+        charts = []
+        for data_type in select_data_types(data_types):
+            data, errors = [get_series_data(values, get_series=lambda char_points: '%d char. p.' % char_points)
+                            for values in self.query(table, ['char_points', 'method_name'],
+                                                     where={'data_type': data_type, 'char_points': is_segmented})]
+            charts.append(Chart(os.path.join(self.output_path, '%s.pdf' % DataType.get_code(data_type)), 'bar',
+                                data,
+                                x_label='Discretization method', y_label=data_type, index=MethodType.get_ordered(),
+                                errors=errors))
+        return charts
+
+
+def get_paired_values(table, data_type):
+    """
+    Pair values of all methods for the same parameters by repetition of experiments, i.e. by the rows of result
+    files they come from. Parameters not run with every method are skipped, as are repetitions missing for some
+    method, e.g. rows with NA, which are skipped, or rows beyond the rows read from some file.
+    :type table: ResultsTable
+    :return: OrderedDict of dicts of values of the same repetitions ordered by repetition, by method, by tuple
+        of labels of parameters in the order of WilcoxonForMethods.PARAMS_KEYS
+    """
+    methods = MethodType.get_ordered()
+    values_by_params = OrderedDict()
+    where = {'data_type': data_type, 'method_name': lambda method_name: bool(method_name)}
+    key_names = WilcoxonForMethods.PARAMS_KEYS + ['method_name']
+    for labels, values in table.group(key_names, where, repetitions=True).iteritems():
+        values_by_params.setdefault(labels[:-1], {})[labels[-1]] = values
+    paired_values = OrderedDict()
+    for labels, values_by_method in values_by_params.iteritems():
+        if any(method not in values_by_method for method in methods):
+            continue
+        common_repetitions = reduce(np.intersect1d, [values_by_method[method][1] for method in methods])
+        paired_values[labels] = dict((method, select_repetitions(values, repetitions, common_repetitions))
+                                     for method, (values, repetitions) in values_by_method.iteritems())
+    return paired_values
+
+
+def select_repetitions(values, repetitions, selected_repetitions):
+    """
+    Select values of the given repetitions, ordered by repetition
+    """
+    order = np.argsort(repetitions, kind='mergesort')
+    return values[order[np.in1d(repetitions[order], selected_repetitions)]]
 
 
 class WilcoxonForMethods(DataAggregation):
-    class IdShortener:
-        def __init__(self):
-            self.artificial_ids = {}
+    class WilcoxonAggregator:
+        def __init__(self, table, data_type):
+            self.table = table
+            self.data_type = data_type
+            self.where = {'data_type': data_type, 'method_name': lambda method_name: bool(method_name)}
+            self._paired_values = None
+            self._aligned_values = {}
+            self._p_values = defaultdict(dict)
 
-        def shorten_id(self, identifier):
-            if identifier not in self.artificial_ids:
-                self.artificial_ids[identifier] = len(self.artificial_ids)
-            return self.artificial_ids[identifier]
+        def get_param_values(self, grouping):
+            return self.table.get_labels(WilcoxonForMethods.GROUPING_KEYS[grouping], self.where)
 
-    class WilcoxonAggregator:
-        def __init__(self):
-            self.dist_id_shortener = WilcoxonForMethods.IdShortener()
-            self.pref_id_shortener = WilcoxonForMethods.IdShortener()
-            self.ch_p_id_shortener = WilcoxonForMethods.IdShortener()
-            self._general_method_values = defaultdict(lambda: defaultdict(list))
-            self.method_values_by_crits_no = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            self.method_values_by_alts_no = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            self.method_values_by_comps_no = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            self.method_values_by_distr = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-            self.method_values_by_ch_p = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-
-        def agg_data(self, data, values):
-            if data.method_name:
-                params_code = self._get_params_code(data)
-                self._general_method_values[params_code][data.method_name].extend(values)
-                self.method_values_by_crits_no[data.crit_number][params_code][data.method_name].extend(values)
-                self.method_values_by_alts_no[data.alt_number][params_code][data.method_name].extend(values)
-                self.method_values_by_comps_no[data.pref_info][params_code][data.method_name].extend(values)
-                self.method_values_by_distr[data.distribution][params_code][data.method_name].extend(values)
-                self.method_values_by_ch_p[data.char_points][params_code][data.method_name].extend(values)
-
-        def get_general_p_value(self, method1, method2):
-            method1_values = []
-            method2_values = []
-            for values_by_method in self._general_method_values.itervalues():
-                method1_values.extend(values_by_method[method1])
-                method2_values.extend(values_by_method[method2])
-            return stats.wilcoxon(method1_values, method2_values)[1]
-
-        def get_p_value_for_param(self, method1, method2, values_for_param):
-            p_values_by_param = {}
-            for param, values_for_param in values_for_param.iteritems():
-                method1_values_for_param = []
-                method2_values_for_param = []
-                for values_by_method in values_for_param.itervalues():
-                    method1_values_for_param.extend(values_by_method[method1])
-                    method2_values_for_param.extend(values_by_method[method2])
-                p_value_for_param = stats.wilcoxon(method1_values_for_param, method2_values_for_param)[1]
-                p_values_by_param[param] = p_value_for_param
-            return p_values_by_param
-
-        def _get_params_code(self, data):
+        def get_general_p_values(self):
+            return self.get_p_values('general', [None])[None]
+
+        def get_p_values(self, grouping, parameter_values):
             """
-            Get unique shorten code for given parameters
-            :param data: parameters
-            :type data: DataUnit
-            :return: int
+            Get p-values of all methods pairs for the given parameter values.
+            Each p-value is computed only once and reused by later calls.
+            :param grouping: name of the parameter grouping the values
+            :param parameter_values: values of the parameter
+            :return: dict of p-values by methods pair, by parameter value
             """
-            return '%d;%d;%d;%d;%d' % (
-                self.dist_id_shortener.shorten_id(data.distribution),
-                data.crit_number,
-                data.alt_number,
-                self.pref_id_shortener.shorten_id(data.pref_info),
-                self.ch_p_id_shortener.shorten_id(data.char_points)
-            )
-
-    def __init__(self, output_path):
-        DataAggregation.__init__(self, output_path)
-        self.aggregators = {
-            DataType.found_solution_number: WilcoxonForMethods.WilcoxonAggregator(),
-            DataType.eps: WilcoxonForMethods.WilcoxonAggregator(),
-            DataType.relations_number: WilcoxonForMethods.WilcoxonAggregator(),
-            DataType.new_relations_number: WilcoxonForMethods.WilcoxonAggregator()
-        }
+            from scipy import stats
 
-    def add_data(self, data):
-        aggregator = self.aggregators[data.data_type]
-        agg_func = agg_row if data.data_type == DataType.found_solution_number else agg_rowcol
-        aggregator.agg_data(data, agg_func(data.path))
+            aligned_values = self._get_aligned_values(grouping)
+            p_values = self._p_values[grouping]
+            methods = MethodType.get_ordered()
+            for param in parameter_values:
+                if param in p_values:
+                    continue
+                if param not in aligned_values:
+                    raise MissingResultsError("Parameter \"%s\" not found in wilcoxon results" % param)
+                values_by_method = aligned_values[param]
+                p_values[param] = {}
+                for method1, method2 in itertools.combinations(methods, 2):
+                    p_value = stats.wilcoxon(values_by_method[method1], values_by_method[method2])[1]
+                    p_values[param][(method1, method2)] = p_value
+                    p_values[param][(method2, method1)] = p_value
+            return dict((param, p_values[param]) for param in parameter_values)
 
-    def generate_wilcoxon_comparisons(self):
-        self._save_wilcoxon_results('found_solution_number', self.aggregators[DataType.found_solution_number])
-        self._save_wilcoxon_results('eps', self.aggregators[DataType.eps])
-        self._save_wilcoxon_results('relations_number', self.aggregators[DataType.relations_number],
-                                    robustness_exp=True)
-        self._save_wilcoxon_results('new_relations_number', self.aggregators[DataType.new_relations_number],
-                                    robustness_exp=True)
+        def _get_aligned_values(self, grouping):
+            """
+            Concatenate paired values of every method for every parameter value, in the same order of parameters,
+            so values of different methods for the same parameters are paired
+            """
+            if self._paired_values is None:
+                self._paired_values = get_paired_values(self.table, self.data_type)
+            if grouping not in self._aligned_values:
+                method_values = defaultdict(lambda: dict((method, []) for method in MethodType.get_ordered()))
+                param_idx = WilcoxonForMethods.PARAMS_KEYS.index(WilcoxonForMethods.GROUPING_KEYS[grouping]) \
+                    if grouping != 'general' else None
+                for labels, values_by_method in self._paired_values.iteritems():
+                    param = labels[param_idx] if param_idx is not None else None
+                    for method, values in values_by_method.iteritems():
+                        method_values[param][method].append(values)
+                self._aligned_values[grouping] = dict(
+                    (param, dict((method, np.concatenate(values) if values else np.zeros(0))
+                                 for method, values in values_by_method.iteritems()))
+                    for param, values_by_method in method_values.iteritems())
+            return self._aligned_values[grouping]
+
+    GROUPING_KEYS = {
+        'criteria': 'crit_number',
+        'alternatives': 'alt_number',
+        'comparisons_no': 'pref_info',
+        'distribution': 'distribution',
+        'characteristic_points': 'char_points'
+    }
+    PARAMS_KEYS = ['distribution', 'crit_number', 'alt_number', 'pref_info', 'char_points']
+
+    def __init__(self, output_path, bootstrap=None):
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+        DataAggregation.__init__(self, output_path, bootstrap)
+
+    def generate_results(self, table, data_types=None):
+        self.generate_wilcoxon_comparisons(table, data_types)
+        return []
+
+    def generate_wilcoxon_comparisons(self, table, data_types=None):
+        for data_type in select_data_types(data_types):
+            self._save_wilcoxon_results(data_type.name, WilcoxonForMethods.WilcoxonAggregator(table, data_type),
+                                        robustness_exp=data_type in ROBUSTNESS_DATA_TYPES)
 
     def _save_wilcoxon_results(self, name, aggregator, robustness_exp=False):
-        self._save_general_wilcoxon_matrix(name, aggregator)
-        self._save_wilcoxon_matrix_by_param(
-            '%s_criteria' % name,
-            lambda m1, m2: aggregator.get_p_value_for_param(m1, m2, aggregator.method_values_by_crits_no),
-            sorted(aggregator.method_values_by_crits_no))
-        self._save_wilcoxon_matrix_by_param(
-            '%s_alternatives' % name,
-            lambda m1, m2: aggregator.get_p_value_for_param(m1, m2, aggregator.method_values_by_alts_no),
-            sorted(aggregator.method_values_by_alts_no))
-        comp_values = [2, 4, 6, 8, 'ranking'] if not robustness_exp else [2, 4, 6, 8]
-        self._save_wilcoxon_matrix_by_param(
-            '%s_comparisons_no' % name,
-            lambda m1, m2: aggregator.get_p_value_for_param(m1, m2, aggregator.method_values_by_comps_no),
-            comp_values)
-        self._save_wilcoxon_matrix_by_param(
-            '%s_distribution' % name,
-            lambda m1, m2: aggregator.get_p_value_for_param(m1, m2, aggregator.method_values_by_distr),
-            DistributionType.get_ordered())
-        self._save_wilcoxon_matrix_by_param(
-            '%s_characteristic_points' % name,
-            lambda m1, m2: aggregator.get_p_value_for_param(m1, m2, aggregator.method_values_by_ch_p),
-            sorted(aggregator.method_values_by_ch_p))
-
-    def _save_general_wilcoxon_matrix(self, name, aggregator):
+        self._save_general_wilcoxon_matrix(name, aggregator.get_general_p_values())
+        parameter_values = {
+            'criteria': sorted(aggregator.get_param_values('criteria')),
+            'alternatives': sorted(aggregator.get_param_values('alternatives')),
+            'comparisons_no': [2, 4, 6, 8, 'ranking'] if not robustness_exp else [2, 4, 6, 8],
+            'distribution': DistributionType.get_ordered(),
+            'characteristic_points': sorted(aggregator.get_param_values('characteristic_points'))
+        }
+        for grouping in ['criteria', 'alternatives', 'comparisons_no', 'distribution', 'characteristic_points']:
+            self._save_wilcoxon_matrix_by_param(
+                '%s_%s' % (name, grouping),
+                aggregator.get_p_values(grouping, parameter_values[grouping]),
+                parameter_values[grouping])
+
+    def _save_general_wilcoxon_matrix(self, name, p_values):
         with open(os.path.join(self.output_path, 'wilcoxon_%s.csv' % name), 'w') as output_file:
             methods = MethodType.get_ordered()
             output_file.write(',%s\n' % ','.join(methods))
@@ -612,12 +1499,12 @@ class WilcoxonForMethods(DataAggregation):
                 output_file.write('%s' % method1)
                 for method2 in methods:
                     if method1 != method2:
-                        output_file.write(',%f' % aggregator.get_general_p_value(method1, method2))
+                        output_file.write(',%f' % p_values[(method1, method2)])
                     else:
                         output_file.write(',')
                 output_file.write('\n')
 
-    def _save_wilcoxon_matrix_by_param(self, name, p_value_for_methods_pair, parameter_values):
+    def _save_wilcoxon_matrix_by_param(self, name, p_values_by_param, parameter_values):
         with open(os.path.join(self.output_path, 'wilcoxon_%s.csv' % name), 'w') as output_file:
             methods = MethodType.get_ordered()
             header_fields = ['%s & %s' % (m1, m2) for m1, m2 in itertools.combinations(methods, 2)]
@@ -625,46 +1512,359 @@ class WilcoxonForMethods(DataAggregation):
             for param in parameter_values:
                 output_file.write('%s' % str(param))
                 for method1, method2 in itertools.combinations(methods, 2):
-                    p_values_for_params = p_value_for_methods_pair(method1, method2)
-                    if param not in p_values_for_params:
-                        raise Exception("Parameter \"%s\" not found in wilcoxon results" % param)
-                    output_file.write(',%f' % p_values_for_params[param])
+                    output_file.write(',%f' % p_values_by_param[param][(method1, method2)])
+                output_file.write('\n')
+
+
+def rank_rows(matrix):
+    """
+    Rank values in every row of a matrix, from 1 for the smallest value, giving tied values their average rank
+    :return: matrix of ranks and matrix of numbers of values equal to every value, itself included
+    """
+    less = (matrix[:, np.newaxis, :] < matrix[:, :, np.newaxis]).sum(axis=2)
+    equal = (matrix[:, np.newaxis, :] == matrix[:, :, np.newaxis]).sum(axis=2)
+    return less + (equal + 1) / 2.0, equal
+
+
+def holm_correction(p_values):
+    """
+    Adjust p-values of every row of a matrix with the Holm step-down procedure
+    """
+    order = np.argsort(p_values, axis=1)
+    tests_number = p_values.shape[1]
+    sorted_p_values = np.take_along_axis(p_values, order, axis=1) * (tests_number - np.arange(tests_number))
+    adjusted = np.empty_like(p_values)
+    np.put_along_axis(adjusted, order, np.minimum(np.maximum.accumulate(sorted_p_values, axis=1), 1), axis=1)
+    return adjusted
+
+
+class FriedmanForMethods(DataAggregation):
+    """
+    Friedman tests comparing all methods at once, followed by post-hoc comparisons of mean ranks of methods:
+    the Nemenyi critical difference and p-values of pairs of methods corrected with the Holm procedure.
+
+    Blocks are repetitions of experiments with the same parameters, i.e. values paired by WilcoxonForMethods.
+    Values are ranked once per data type in a blocks x methods matrix, then statistics for all values of
+    a parameter are computed together from sums of ranks by labels of blocks.
+    """
+    # critical values of the Nemenyi test for alpha = 0.05 by number of methods (Demsar, 2006)
+    NEMENYI_Q_ALPHA = {2: 1.960, 3: 2.343, 4: 2.569, 5: 2.728, 6: 2.850, 7: 2.949, 8: 3.031, 9: 3.102, 10: 3.164}
+
+    def __init__(self, output_path, bootstrap=None):
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+        DataAggregation.__init__(self, output_path, bootstrap)
+
+    def generate_results(self, table, data_types=None):
+        for data_type in select_data_types(data_types):
+            self._save_friedman_results(data_type.name, table, data_type,
+                                        robustness_exp=data_type in ROBUSTNESS_DATA_TYPES)
+        return []
+
+    def _save_friedman_results(self, name, table, data_type, robustness_exp=False):
+        blocks, params_labels, blocks_numbers = self._get_blocks(table, data_type)
+        ranks, equal = rank_rows(blocks)
+        ties = (equal ** 2 - 1).sum(axis=1)
+        self._save_friedman_table('friedman_%s.csv' % name, [None],
+                                  self._get_statistics(ranks, ties, np.zeros(len(blocks), dtype=np.int64), 1))
+        for grouping in ['criteria', 'alternatives', 'comparisons_no', 'distribution', 'characteristic_points']:
+            key_idx = WilcoxonForMethods.PARAMS_KEYS.index(WilcoxonForMethods.GROUPING_KEYS[grouping])
+            group_labels = [labels[key_idx] for labels in params_labels]
+            if grouping == 'comparisons_no':
+                parameter_values = [2, 4, 6, 8, 'ranking'] if not robustness_exp else [2, 4, 6, 8]
+            elif grouping == 'distribution':
+                parameter_values = DistributionType.get_ordered()
+            else:
+                parameter_values = sorted(set(group_labels))
+            parameter_values = [param for param in parameter_values if param in group_labels]
+            group_codes = np.array([parameter_values.index(label) if label in parameter_values else -1
+                                    for label in group_labels], dtype=np.int64)
+            block_codes = np.repeat(group_codes, blocks_numbers)
+            selected = block_codes >= 0
+            self._save_friedman_table('friedman_%s_%s.csv' % (name, grouping), parameter_values,
+                                      self._get_statistics(ranks[selected], ties[selected], block_codes[selected],
+                                                           len(parameter_values)))
+
+    def _get_blocks(self, table, data_type):
+        """
+        Pair values of all methods for the same parameters into blocks.
+        Parameters not run with every method are skipped, as are repetitions missing for some method.
+        :return: blocks x methods matrix of values, labels of parameters of groups of blocks, in the order of
+            PARAMS_KEYS, and numbers of blocks of these groups
+        """
+        methods = MethodType.get_ordered()
+        blocks = []
+        params_labels = []
+        blocks_numbers = []
+        for labels, values_by_method in get_paired_values(table, data_type).iteritems():
+            blocks.append(np.column_stack([values_by_method[method] for method in methods]))
+            params_labels.append(labels)
+            blocks_numbers.append(len(values_by_method[methods[0]]))
+        blocks = np.concatenate(blocks) if blocks else np.zeros((0, len(methods)))
+        return blocks, params_labels, np.array(blocks_numbers, dtype=np.int64)
+
+    def _get_statistics(self, ranks, ties, block_codes, groups_number):
+        """
+        Compute statistics of groups of blocks given by their codes
+        :param ranks: blocks x methods matrix of ranks
+        :param ties: sum of t^3 - t over groups of t tied values, for every block
+        :return: dict of arrays of a value or a row for every group
+        """
+        from scipy import stats
+
+        methods_number = ranks.shape[1]
+        blocks_numbers = np.bincount(block_codes, minlength=groups_number).astype(np.float64)
+        rank_sums = np.column_stack([np.bincount(block_codes, weights=ranks[:, method_idx], minlength=groups_number)
+                                     for method_idx in xrange(methods_number)])
+        ties_sums = np.bincount(block_codes, weights=ties, minlength=groups_number)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            statistic = (12.0 / (blocks_numbers * methods_number * (methods_number + 1)) *
+                         (rank_sums ** 2).sum(axis=1) - 3 * blocks_numbers * (methods_number + 1)) / \
+                (1 - ties_sums / (blocks_numbers * methods_number * (methods_number ** 2 - 1)))
+            mean_ranks = rank_sums / blocks_numbers[:, np.newaxis]
+            standard_error = np.sqrt(methods_number * (methods_number + 1) / (6 * blocks_numbers))
+            pairs = list(itertools.combinations(xrange(methods_number), 2))
+            z = np.column_stack([np.abs(mean_ranks[:, idx1] - mean_ranks[:, idx2]) for idx1, idx2 in pairs]) / \
+                standard_error[:, np.newaxis]
+        return {
+            'blocks': blocks_numbers,
+            'statistic': statistic,
+            'p_value': stats.chi2.sf(statistic, methods_number - 1),
+            'critical_difference': self.NEMENYI_Q_ALPHA.get(methods_number, np.nan) * standard_error,
+            'mean_ranks': mean_ranks,
+            'holm_p_values': holm_correction(2 * stats.norm.sf(z))
+        }
+
+    def _save_friedman_table(self, output_name, parameter_values, statistics):
+        with open(os.path.join(self.output_path, output_name), 'w') as output_file:
+            methods = MethodType.get_ordered()
+            header_fields = ['blocks', 'statistic', 'p_value', 'critical_difference'] + \
+                ['rank %s' % method for method in methods] + \
+                ['%s & %s' % (m1, m2) for m1, m2 in itertools.combinations(methods, 2)]
+            output_file.write(',%s\n' % ','.join(header_fields))
+            for param_idx, param in enumerate(parameter_values):
+                output_file.write('%s' % (str(param) if param is not None else 'all'))
+                output_file.write(',%d' % statistics['blocks'][param_idx])
+                for field in ['statistic', 'p_value', 'critical_difference']:
+                    output_file.write(',%f' % statistics[field][param_idx])
+                for value in np.concatenate([statistics['mean_ranks'][param_idx],
+                                             statistics['holm_p_values'][param_idx]]):
+                    output_file.write(',%f' % value)
                 output_file.write('\n')
 
 
-def collect_data(aggregation_method, data_path):
-    files_paths = get_all_files_paths(data_path)
+AGGREGATIONS = [
+    AggregationByCharPoints,
+    AggregationByMethods,
+    SummaryAggregationByMethod,
+    WilcoxonForMethods
+]
+
+
+def get_aggregation_classes(friedman=False, preview=False):
+    """
+    Get classes of all aggregations, with Friedman tests instead of Wilcoxon tests if friedman is set.
+    Previews get only aggregations plotting charts, tests pair values of all repetitions of methods.
+    """
+    if preview:
+        return [aggregation_class for aggregation_class in AGGREGATIONS if aggregation_class is not WilcoxonForMethods]
+    return [aggregation_class if aggregation_class is not WilcoxonForMethods or not friedman else FriedmanForMethods
+            for aggregation_class in AGGREGATIONS]
+
+
+def get_results_filter(distributions=None, matrix_sizes=None, preferences=None, models=None, sharded=False):
+    """
+    Get a filter of result files read by aggregations, restricted to the given names or patterns of directories
+    :param sharded: whether paths of files of shards are filtered, below directories of shards
+    :rtype: PathFilter
+    """
+    data_types = DATA_TYPE_FILES + [file_name + suffix for file_name in DATA_TYPE_FILES
+                                    for suffix in sorted(COMPRESSION_SUFFIXES.values())]
+    return PathFilter(distributions, matrix_sizes, preferences, models, data_types, skipped_levels=1 if sharded else 0)
+
+
+def iter_data_records(data_path, workers=1, files_paths=None, path_filter=None, rows_number=ROWS_NUMBER, sharded=False,
+                      sampling=None):
+    """
+    Walk the results tree once and yield every recognised file together with its parsed values
+    :param data_path: path to merged results of experiments, or to shards of results if sharded is set
+    :param workers: number of processes parsing the files
+    :param files_paths: paths of files to read, relative to data_path, files of the tree accepted by path_filter
+        by default
+    :param path_filter: filter of walked paths, all result files are read by default
+    :type path_filter: PathFilter
+    :param rows_number: number of rows read from every file, all rows if None
+    :param sharded: whether shards are read as merged results, every file streamed from the files of shards
+        behind it, without merging them
+    :param sampling: sampling of files of a preview, all files are read if None
+    :type sampling: Sampling
+    :return: generator of (DataUnit, values, repetitions) tuples, repetitions of experiments of values are
+        indices of their rows in the file
+    """
+    if files_paths is None and sharded:
+        files_paths = iter_sharded_files(data_path, path_filter or get_results_filter(sharded=True))
+    elif files_paths is None:
+        files_paths = iter_files_paths(data_path, path_filter or get_results_filter())
+    if sampling is not None:
+        files_paths = sampling.select(data_path, files_paths)
+    if workers > 1:
+        return _iter_data_records_in_pool(data_path, files_paths, workers, rows_number)
+    return _iter_data_records(data_path, files_paths, rows_number)
+
+
+def _print_progress(files_number, files_paths):
+    if isinstance(files_paths, list):
+        print 'Number of preprocessed files: %d/%d' % (files_number, len(files_paths))
+    else:
+        print 'Number of preprocessed files: %d' % files_number
+
+
+def _iter_data_records(data_path, files_paths, rows_number):
     interpreter = PathInterpreter(data_path)
     for file_idx, file_path in enumerate(files_paths):
         data_unit = interpreter.interpret(file_path)
         if data_unit is not None:
-            aggregation_method.add_data(data_unit)
+            values, repetitions = get_agg_func(data_unit.data_type, rows_number)(data_unit.path)
+            yield data_unit, values, repetitions
         if (file_idx + 1) % 1000 == 0:
-            print 'Number of preprocessed files: %d/%d' % (file_idx + 1, len(files_paths))
-
+            _print_progress(file_idx + 1, files_paths)
 
-def aggregate_data(output_path, data_path):
-    char_points_aggregation = AggregationByCharPoints(output_path)
-    collect_data(char_points_aggregation, data_path)
-    char_points_aggregation.generate_charts()
 
-    method_aggregation = AggregationByMethods(output_path)
-    collect_data(method_aggregation, data_path)
-    method_aggregation.generate_charts()
-
-    summary_aggregation = SummaryAggregationByMethod(output_path)
-    collect_data(summary_aggregation, data_path)
-    summary_aggregation.generate_charts()
-
-    wilcoxon_for_methods = WilcoxonForMethods(output_path)
-    collect_data(wilcoxon_for_methods, data_path)
-    wilcoxon_for_methods.generate_wilcoxon_comparisons()
+def _parse_files_chunk(args):
+    data_path, files_paths, rows_number = args
+    interpreter = PathInterpreter(data_path)
+    records = []
+    for file_path in files_paths:
+        data_unit = interpreter.interpret(file_path)
+        if data_unit is not None:
+            values, repetitions = get_agg_func(data_unit.data_type, rows_number)(data_unit.path)
+            records.append((data_unit, values, repetitions))
+    return records, len(files_paths)
+
+
+def _parse_files_chunk_counting(args):
+    return instrumentation.call_counting(_parse_files_chunk, args)
+
+
+def _iter_chunks(data_path, files_paths, rows_number):
+    files_paths = iter(files_paths)
+    while True:
+        chunk = list(itertools.islice(files_paths, FILES_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield data_path, chunk, rows_number
+
+
+def _iter_data_records_in_pool(data_path, files_paths, workers, rows_number):
+    """
+    Parse chunks of the files list in a pool of processes, while the list is still being walked.
+    Chunks are consumed in the order of the files list, so the records come in the same order as in a serial run.
+    """
+    pool = multiprocessing.Pool(workers)
+    files_number = 0
+    try:
+        for (records, chunk_size), counters in pool.imap(_parse_files_chunk_counting,
+                                                         _iter_chunks(data_path, files_paths, rows_number)):
+            instrumentation.add_counters(counters)
+            for record in records:
+                yield record
+            files_number += chunk_size
+            _print_progress(files_number, files_paths)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def load_results_table(records):
+    """
+    Load all records into a results table
+    :param records: (DataUnit, values, repetitions) tuples
+    :rtype: ResultsTable
+    """
+    table = ResultsTable()
+    for data_unit, values, repetitions in records:
+        table.add(data_unit, values, repetitions)
+    return table
+
+
+def collect_data(data_path):
+    return load_results_table(iter_data_records(data_path))
+
+
+def aggregate_records(output_path, records, workers=1, aggregation_classes=None, bootstrap=None, sampling=None):
+    """
+    Load records into a results table, save results of aggregations querying it and render their charts
+    :param output_path: output path
+    :param records: (DataUnit, values, repetitions) tuples
+    :param workers: number of processes rendering charts
+    :param aggregation_classes: classes of aggregations to run, all aggregations by default
+    :param bootstrap: bootstrap of confidence intervals of plotted means, none are computed if not given
+    :type bootstrap: Bootstrap
+    :param sampling: sampling of files of the records of a preview, its charts are noted as a preview and always
+        have intervals of the sampling error, computed with the resamples and confidence of bootstrap if given
+    :type sampling: Sampling
+    """
+    if sampling is not None:
+        bootstrap = SamplingBootstrap(sampling, *([bootstrap.resamples, bootstrap.confidence] if bootstrap else []))
+    aggregations = [aggregation_class(output_path, bootstrap)
+                    for aggregation_class in aggregation_classes or AGGREGATIONS]
+    with instrumentation.stage('collect', profiled=True):
+        table = load_results_table(records)
+    charts = []
+    for aggregation in aggregations:
+        with instrumentation.stage('results:%s' % aggregation.__class__.__name__):
+            charts.extend(aggregation.generate_results(table))
+    if sampling is not None:
+        for chart in charts:
+            chart.note = sampling.get_note(bootstrap.confidence)
+    with instrumentation.stage('render'):
+        ChartRenderer(workers).render(charts)
+
+
+def aggregate_data(output_path, data_path, workers=1, path_filter=None, bootstrap=None, aggregation_classes=None,
+                   rows_number=ROWS_NUMBER, sharded=False, sampling=None):
+    aggregate_records(output_path, iter_data_records(data_path, workers, path_filter=path_filter,
+                                                     rows_number=rows_number, sharded=sharded, sampling=sampling),
+                      workers, aggregation_classes, bootstrap, sampling)
+
+
+def get_rows_number(args):
+    return None if args.all_rows else ROWS_NUMBER
+
+
+def get_bootstrap(args):
+    return Bootstrap(args.bootstrap, args.confidence) if args.bootstrap else None
+
+
+def get_sampling(args):
+    return Sampling(args.preview) if args.preview else None
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("output_path", help="output path")
-    parser.add_argument("data_path", help="path to merged results of experiments")
+    parser.add_argument("data_path", help="path to merged results of experiments, or to shards with --sharded")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes parsing result files and rendering charts (default: %(default)s)")
+    parser.add_argument("--metrics", help="output path of the JSON lines report of metrics of processing stages")
+    parser.add_argument("--profile",
+                        help="output path of cProfile stats of collecting data, suffixed with the stage name")
+    add_sharded_arguments(parser)
+    add_rows_arguments(parser)
+    add_tests_arguments(parser)
+    add_path_filter_arguments(parser)
+    add_bootstrap_arguments(parser)
+    add_preview_arguments(parser)
     args = parser.parse_args()
 
-    aggregate_data(args.output_path, args.data_path)
+    if args.metrics or args.profile:
+        instrumentation.enable(args.profile)
+    aggregate_data(args.output_path, args.data_path, args.workers, get_results_filter(
+        args.distributions, args.matrix_sizes, args.preferences, args.models, args.sharded), get_bootstrap(args),
+        get_aggregation_classes(args.friedman, bool(args.preview)), get_rows_number(args), args.sharded,
+        get_sampling(args))
+    if args.metrics:
+        instrumentation.save_report(args.metrics)
@@ -0,0 +1,151 @@
+"""
+Benchmark of merging and aggregating results of experiments on synthetic trees of results.
+
+Every run appends a record with times of all stages to a history file and is compared with previous runs
+of the same configuration, so slower stages are reported as regressions.
+"""
+import argparse
+from collections import OrderedDict
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from aggregate_results import AggregationByCharPoints, AggregationByMethods, ChartRenderer, \
+    SummaryAggregationByMethod, WilcoxonForMethods, iter_data_records, load_results_table
+from experiments_grid import MATRIX_SIZES
+from generate_results_tree import generate_tree
+from merge_results import merge_data, verify_files
+
+
+HISTORY_FILE = 'benchmark-history.jsonl'
+TOLERANCE = 0.2
+MIN_REGRESSION_SECONDS = 0.1
+
+
+def measure(stages_times, stage, func, *args):
+    start_time = time.time()
+    result = func(*args)
+    stages_times[stage] = time.time() - start_time
+    return result
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def render_charts(aggregations, table, workers):
+    charts = []
+    for aggregation in aggregations:
+        charts.extend(aggregation.generate_results(table))
+    ChartRenderer(workers).render(charts)
+
+
+def run_benchmark(work_path, matrix_sizes_number, shards, rows_number, workers):
+    """
+    Time all stages of processing a synthetic tree of results.
+    Trees are generated once for every configuration and reused by later runs.
+    :param work_path: directory of generated trees and outputs
+    :param matrix_sizes_number: number of sizes of performance matrices, which sets the size of the tree
+    :param shards: number of shards merged into results
+    :param rows_number: number of rows of every file of a shard
+    :param workers: number of processes used by every stage
+    :return: record of the run
+    """
+    config = OrderedDict([('matrix_sizes_number', matrix_sizes_number), ('shards', shards),
+                          ('rows_number', rows_number), ('workers', workers)])
+    tree_path = os.path.join(work_path, 'tree-%d-sizes-%d-shards-%d-rows' % (matrix_sizes_number, shards,
+                                                                             rows_number))
+    data_path = os.path.join(tree_path, 'raw')
+    if not os.path.exists(data_path):
+        generate_tree(data_path + '.tmp', shards, rows_number, matrix_sizes=MATRIX_SIZES[:matrix_sizes_number])
+        os.rename(data_path + '.tmp', data_path)
+    run_path = os.path.join(tree_path, 'run')
+    if os.path.exists(run_path):
+        shutil.rmtree(run_path)
+    os.makedirs(run_path)
+    merged_path = os.path.join(run_path, 'merged')
+    output_path = os.path.join(run_path, 'output')
+
+    stages_times = OrderedDict()
+    measure(stages_times, 'merge', merge_data, merged_path, data_path, workers)
+    errors = measure(stages_times, 'verify', verify_files, merged_path)
+    chart_aggregations = [AggregationByCharPoints(output_path), AggregationByMethods(output_path),
+                          SummaryAggregationByMethod(output_path)]
+    wilcoxon = WilcoxonForMethods(output_path)
+    table = measure(stages_times, 'collect', load_results_table,
+                    iter_data_records(merged_path, workers))
+    measure(stages_times, 'charts', render_charts, chart_aggregations, table, workers)
+    measure(stages_times, 'wilcoxon', wilcoxon.generate_results, table)
+
+    return OrderedDict([
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('revision', get_revision()),
+        ('config', config),
+        ('files_number', sum(len(files) for _, _, files in os.walk(data_path))),
+        ('verification_errors', len(errors)),
+        ('stages', stages_times)
+    ])
+
+
+def load_history(history_path):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r') as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def find_regressions(record, history, tolerance=TOLERANCE):
+    """
+    Compare times of stages with the best times of previous runs of the same configuration
+    :return: list of descriptions of stages slower than the best time by more than the tolerance
+    """
+    regressions = []
+    previous_records = [previous for previous in history if previous['config'] == record['config']]
+    for stage, stage_time in record['stages'].iteritems():
+        previous_times = [previous['stages'][stage] for previous in previous_records if stage in previous['stages']]
+        if not previous_times:
+            continue
+        best_time = min(previous_times)
+        if stage_time > best_time * (1 + tolerance) and stage_time - best_time > MIN_REGRESSION_SECONDS:
+            regressions.append('%s: %.2f s, best previous: %.2f s' % (stage, stage_time, best_time))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("work_path", help="directory of generated trees and outputs")
+    parser.add_argument("--matrix-sizes-numbers", nargs='+', type=int, default=[1, 2, 4],
+                        help="sizes of benchmarked trees as numbers of sizes of performance matrices "
+                             "(default: %(default)s)")
+    parser.add_argument("--shards", type=int, default=2, help="number of merged shards (default: %(default)s)")
+    parser.add_argument("--rows", type=int, default=60,
+                        help="number of rows of every file of a shard (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used by every stage (default: %(default)s)")
+    parser.add_argument("--history", help="path of the history of runs (default: <work_path>/%s)" % HISTORY_FILE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="relative slowdown of a stage reported as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.work_path):
+        os.makedirs(args.work_path)
+    history_path = args.history or os.path.join(args.work_path, HISTORY_FILE)
+    history = load_history(history_path)
+    all_regressions = []
+    for matrix_sizes_number in args.matrix_sizes_numbers:
+        record = run_benchmark(args.work_path, matrix_sizes_number, args.shards, args.rows, args.workers)
+        record['regressions'] = find_regressions(record, history, args.tolerance)
+        with open(history_path, 'a') as history_file:
+            history_file.write(json.dumps(record) + '\n')
+        print 'Files: %d, %s' % (record['files_number'], ', '.join(
+            '%s: %.2f s' % (stage, stage_time) for stage, stage_time in record['stages'].iteritems()))
+        for regression in record['regressions']:
+            print 'Regression in %s' % regression
+        all_regressions.extend(record['regressions'])
+    sys.exit(1 if all_regressions else 0)
@@ -0,0 +1,37 @@
+"""
+Grid of parameters of experiments of R/experiments.R, shared by the scheduler of experiments and the generator
+of synthetic results.
+"""
+
+
+DISTRIBUTIONS = ['UNIFORM', 'SKEW_NORMAL']
+MATRIX_SIZES = ['3x5', '5x6', '4x8', '6x10', '3x12', '5x14', '8x8', '7x12']
+PREFERENCES = ['pref-2', 'pref-4', 'pref-6', 'pref-8', 'ranking']
+CHAR_POINTS = [3, 4, 5, 6]
+METHODS = ['EQUAL_FREQ_INTERVAL', 'EQUAL_WIDTH_INTERVAL', 'GHADERI_DISCRETIZATION', 'KERNEL_DENSITY_ESTIMATION',
+           'K_MEANS']
+
+
+def get_models(char_points, methods):
+    return ['LINEAR', 'GENERAL'] + ['SEGMENTED-%d-%s' % (char_points_number, method)
+                                    for char_points_number in char_points for method in methods]
+
+
+def get_pairs_number(matrix_size):
+    alt_number = int(matrix_size.split('x')[1])
+    return alt_number * (alt_number - 1) / 2
+
+
+def get_preferences(matrix_size, preferences):
+    """
+    Get preferences examined for a matrix size. As launchAllExperimentsForPerfs, preferences are examined in
+    the given order until the first number of pairwise comparisons greater than the number of pairs of
+    alternatives, which is skipped together with all preferences after it, ranking included.
+    """
+    pairs_number = get_pairs_number(matrix_size)
+    examined_preferences = []
+    for pref in preferences:
+        if pref != 'ranking' and int(pref[len('pref-'):]) > pairs_number:
+            break
+        examined_preferences.append(pref)
+    return examined_preferences
@@ -0,0 +1,108 @@
+"""
+Generator of synthetic results of experiments, in the layout written by R/experiments.R
+and read by merge_results.py and aggregate_results.py.
+"""
+import argparse
+import os
+import zlib
+import numpy as np
+from experiments_grid import CHAR_POINTS, DISTRIBUTIONS, MATRIX_SIZES, METHODS, PREFERENCES, get_models, \
+    get_pairs_number, get_preferences
+from utils import COMPRESSION_SUFFIXES, add_compression_suffix, start_compressed_writer
+
+
+NA_ROW = 'NA'
+
+
+class ResultsGenerator:
+    """
+    Writes result files of every data type with values depending on the model,
+    so the generated charts and Wilcoxon tests have differences to show.
+    """
+    def __init__(self, rows_number, na_rate, seed=0, compression=None):
+        self.rows_number = rows_number
+        self.na_rate = na_rate
+        self.random = np.random.RandomState(seed)
+        self.compression = compression
+
+    def write_files(self, path, matrix_size, model):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        pairs_number = get_pairs_number(matrix_size)
+        model_shift = (zlib.crc32(model) % 100) / 100.0
+        self._write(os.path.join(path, 'foundsolutionsnumber.csv'),
+                    ['%d' % value for value in self.random.binomial(100, 0.4 + 0.5 * model_shift, self.rows_number)],
+                    with_na=False)
+        self._write(os.path.join(path, 'epsvalues.csv'),
+                    ['%.6f' % value for value in self.random.beta(2, 5 + 5 * model_shift, self.rows_number)])
+        self._write(os.path.join(path, 'relationsnumbers.csv'),
+                    ['%d' % value for value in self.random.binomial(pairs_number, 0.3 + 0.4 * model_shift,
+                                                                    self.rows_number)])
+        self._write(os.path.join(path, 'prefindrelationsnumbers.csv'),
+                    ['%d' % value for value in self.random.binomial(pairs_number, 0.1 + 0.2 * model_shift,
+                                                                    self.rows_number)])
+        self._write(os.path.join(path, 'rob-foundsolutionsnumber.csv'),
+                    ['%d' % value for value in self.random.binomial(100, 0.5, self.rows_number)])
+
+    def _write(self, file_path, rows, with_na=True):
+        if with_na and self.na_rate > 0:
+            na_rows = self.random.random_sample(len(rows)) < self.na_rate
+            rows = [NA_ROW if is_na else row for row, is_na in zip(rows, na_rows)]
+        with open(add_compression_suffix(file_path, self.compression), 'wb') as output_file:
+            writer = start_compressed_writer(output_file, self.compression)
+            writer.write('\n'.join(rows))
+            writer.write('\n')
+            writer.close()
+
+
+def generate_tree(output_path, shards=0, rows_number=120, na_rate=0.02, distributions=DISTRIBUTIONS,
+                  matrix_sizes=MATRIX_SIZES, preferences=PREFERENCES, char_points=CHAR_POINTS, methods=METHODS, seed=0,
+                  compression=None):
+    """
+    Write a synthetic tree of results of experiments
+    :param output_path: output path
+    :param shards: number of shard directories, as written by separate runs of experiments,
+        0 writes the layout of merged results
+    :param rows_number: number of rows of every file
+    :param na_rate: probability of a NA row in files which may contain them
+    :param compression: compression of written files, 'gz', 'zst' or None
+    :return: number of written files
+    """
+    generator = ResultsGenerator(rows_number, na_rate, seed, compression)
+    shard_dirs = ['shard-%d' % shard for shard in xrange(shards)] if shards > 0 else ['']
+    files_number = 0
+    for shard_dir in shard_dirs:
+        for distribution in distributions:
+            for matrix_size in matrix_sizes:
+                for pref in get_preferences(matrix_size, preferences):
+                    for model in get_models(char_points, methods):
+                        path = os.path.join(output_path, shard_dir, distribution, matrix_size, pref, model)
+                        generator.write_files(path, matrix_size, model)
+                        files_number += 5
+    return files_number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_path", help="output path")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="number of shard directories, 0 writes the layout of merged results "
+                             "(default: %(default)s)")
+    parser.add_argument("--rows", type=int, default=120, help="number of rows of every file (default: %(default)s)")
+    parser.add_argument("--na-rate", type=float, default=0.02,
+                        help="probability of a NA row (default: %(default)s)")
+    parser.add_argument("--distributions", nargs='+', default=DISTRIBUTIONS, choices=DISTRIBUTIONS)
+    parser.add_argument("--matrix-sizes", nargs='+', default=MATRIX_SIZES, help="CxA sizes of performance matrices")
+    parser.add_argument("--preferences", nargs='+', default=PREFERENCES, help="pref-N or ranking")
+    parser.add_argument("--char-points", nargs='+', type=int, default=CHAR_POINTS,
+                        help="numbers of characteristic points of segmented models")
+    parser.add_argument("--methods", nargs='+', default=METHODS, choices=METHODS, help="discretization methods")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator (default: %(default)s)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSION_SUFFIXES),
+                        help="compress written files with gzip or zstd")
+    args = parser.parse_args()
+
+    files_number = generate_tree(args.output_path, args.shards, args.rows, args.na_rate, args.distributions,
+                                 args.matrix_sizes, args.preferences, args.char_points, args.methods, args.seed,
+                                 args.compression)
+    print 'Generated files: %d' % files_number
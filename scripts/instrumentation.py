@@ -0,0 +1,171 @@
+"""
+Instrumentation of processing stages.
+
+Stages record wall and CPU time, the peak memory of the process and the counters (files and bytes read, parsed
+values, NA rows, hits of the caches of rendered charts and of the result store...) incremented while they were
+open. Results are collected in a single pass, so files_read of the collect stage tells that every result file
+was parsed once. Counters are kept per process, so functions run in a pool
+of processes are called with call_counting, which returns the counters they incremented, and the parent
+process adds them with add_counters.
+"""
+from collections import defaultdict, OrderedDict
+import cProfile
+import json
+import os
+import resource
+import time
+
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.children_cpu_time = 0.0
+        self.process_peak_rss_mb = None
+        self.counters = defaultdict(int)
+
+    def to_dict(self):
+        result = OrderedDict([
+            ('stage', self.name),
+            ('calls', self.calls),
+            ('wall_time', self.wall_time),
+            ('cpu_time', self.cpu_time),
+            ('children_cpu_time', self.children_cpu_time),
+            ('process_peak_rss_mb', self.process_peak_rss_mb)
+        ])
+        result.update(sorted(self.counters.iteritems()))
+        return result
+
+
+def get_cpu_times():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_utime + self_usage.ru_stime,
+            children_usage.ru_utime + children_usage.ru_stime)
+
+
+def get_process_peak_rss_mb():
+    """
+    Peak resident set size of this process or of its largest finished child process since they started, in MB.
+    It is not reset between stages, so a stage reports the peak of all stages run until its end.
+    """
+    peak_rss_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak_rss_kb / 1024.0
+
+
+class Stage:
+    """
+    Context manager measuring a single run of a stage
+    """
+    def __init__(self, instrumentation, name, profiled):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.profiler = instrumentation.get_profiler(name) if profiled and instrumentation.profile_path else None
+
+    def __enter__(self):
+        self.counters = dict(self.instrumentation.counters)
+        self.cpu_times = get_cpu_times()
+        self.wall_time = time.time()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is not None:
+            self.profiler.disable()
+            # stats of all runs of the stage so far, in a file of the stage
+            self.profiler.dump_stats(self.instrumentation.get_profile_path(self.name))
+        wall_time = time.time() - self.wall_time
+        cpu_time, children_cpu_time = get_cpu_times()
+        metrics = self.instrumentation.get_stage(self.name)
+        metrics.calls += 1
+        metrics.wall_time += wall_time
+        metrics.cpu_time += cpu_time - self.cpu_times[0]
+        metrics.children_cpu_time += children_cpu_time - self.cpu_times[1]
+        metrics.process_peak_rss_mb = get_process_peak_rss_mb()
+        for name, value in self.instrumentation.counters.iteritems():
+            if value != self.counters.get(name, 0):
+                metrics.counters[name] += value - self.counters.get(name, 0)
+
+
+class Instrumentation:
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.stages = OrderedDict()
+        self.enabled = False
+        self.profile_path = None
+        self._profilers = {}
+
+    def enable(self, profile_path=None):
+        """
+        Enable measurements which cost time even if their results are not saved: counters, and profiling of stages
+        marked as profiled
+        :param profile_path: output path of cProfile stats of profiled stages, the name of every stage is added
+            to the name of its file, e.g. profile-collect.prof for profile.prof
+        """
+        self.enabled = True
+        self.profile_path = profile_path
+
+    def get_profile_path(self, name):
+        root, extension = os.path.splitext(self.profile_path)
+        return '%s-%s%s' % (root, name.replace(':', '-'), extension)
+
+    def get_profiler(self, name):
+        if name not in self._profilers:
+            self._profilers[name] = cProfile.Profile()
+        return self._profilers[name]
+
+    def stage(self, name, profiled=False):
+        """
+        Measure a stage, use as: with instrumentation.stage('name'): ...
+        Stages may be nested and a stage run many times accumulates its measurements.
+        :param profiled: whether the stage is profiled if a profile path is set
+        """
+        return Stage(self, name, profiled)
+
+    def get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageMetrics(name)
+        return self.stages[name]
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def take_counters(self):
+        """
+        Get counters incremented since the previous call and reset them
+        """
+        counters = dict(self.counters)
+        self.counters.clear()
+        return counters
+
+    def call_counting(self, func, args):
+        """
+        Call func(args) and return its result together with the counters it incremented.
+        The incremented counters are removed from counters of this process, so they can be added with
+        add_counters whether func was called in this process or in another one.
+        """
+        counters = self.take_counters()
+        result = func(args)
+        func_counters = self.take_counters()
+        self.add_counters(counters)
+        return result, func_counters
+
+    def add_counters(self, counters):
+        for name, value in counters.iteritems():
+            self.counters[name] += value
+
+    def save_report(self, report_path):
+        """
+        Save metrics of all stages as JSON lines
+        """
+        with open(report_path, 'w') as report_file:
+            for metrics in self.stages.itervalues():
+                report_file.write(json.dumps(metrics.to_dict()) + '\n')
+
+
+instrumentation = Instrumentation()
@@ -1,44 +1,294 @@
 import argparse
+from collections import OrderedDict
+import json
+import multiprocessing
 import os
-from utils import get_all_files_paths
+import re
+import time
+from instrumentation import instrumentation
+from utils import add_merge_arguments, get_compression, group_by_output_file, iter_files_paths, open_result_file, \
+    start_compressed_writer, write_json_atomically
 
 
-def merge_files(output_path, data_path):
-    files_paths = get_all_files_paths(data_path)
-    for file_path in files_paths:
-        output_file_path = os.path.join(output_path, file_path[file_path.index('/') + 1:])
-        if not os.path.exists(os.path.dirname(output_file_path)):
+MIN_LINES_NUMBER = 100
+COPY_BUFFER_SIZE = 1024 * 1024
+MANIFEST_VERSION = 1
+MANIFEST_SAVE_INTERVAL = 30
+NON_EMPTY_LINE_RE = re.compile(r'^[ \t\r\f\v]*\S', re.M)
+
+
+class NonEmptyLinesCounter:
+    """
+    Counts non-empty lines of a file given block by block
+    """
+    def __init__(self, lines_number=0, line_counted=False):
+        self.lines_number = lines_number
+        self.line_counted = line_counted
+
+    def update(self, block):
+        first_newline = block.find('\n')
+        head = block if first_newline < 0 else block[:first_newline]
+        if not self.line_counted and head.strip():
+            self.lines_number += 1
+            self.line_counted = True
+        if first_newline < 0:
+            return
+        last_newline = block.rfind('\n')
+        self.lines_number += len(NON_EMPTY_LINE_RE.findall(block, first_newline + 1, last_newline + 1))
+        self.line_counted = bool(block[last_newline + 1:].strip())
+        self.lines_number += self.line_counted
+
+
+def count_non_empty_lines(file_path):
+    counter = NonEmptyLinesCounter()
+    instrumentation.count('files_read')
+    with open_result_file(file_path) as input_file:
+        for block in iter(lambda: input_file.read(COPY_BUFFER_SIZE), ''):
+            instrumentation.count('bytes_read', len(block))
+            counter.update(block)
+    return counter
+
+
+def copy_counting_lines(input_file, output_file, counter):
+    instrumentation.count('files_read')
+    for block in iter(lambda: input_file.read(COPY_BUFFER_SIZE), ''):
+        instrumentation.count('bytes_read', len(block))
+        output_file.write(block)
+        counter.update(block)
+
+
+def get_input_info(input_file_path):
+    stat = os.stat(input_file_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+class MergeManifest:
+    """
+    Record of input files appended to every output file.
+
+    For every output file the manifest keeps its size and number of non-empty lines after the last recorded
+    append, together with the size and modification time of every input file appended to it. Bytes past
+    the recorded size come from an interrupted append, so they are truncated before the merge is resumed.
+    Output files missing from the manifest may hold any of their inputs already, so they are not appended to,
+    only rebuilt from scratch. Output files missing from the disk or shorter than recorded lost some of their
+    appended inputs, so their entries are reset and they are merged again from scratch.
+    """
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest['version'] != MANIFEST_VERSION:
+                raise Exception('Unsupported merge manifest version: %s' % manifest['version'])
+            self.outputs = manifest['outputs']
+        else:
+            self.outputs = {}
+
+    def save(self):
+        write_json_atomically(self.manifest_path, {'version': MANIFEST_VERSION, 'outputs': self.outputs})
+
+    def start_output(self, output_file_path, relative_path, rebuild=False):
+        """
+        Record the initial state of an output file before anything is appended to it
+        :param rebuild: whether an existing output file missing from the manifest is merged again from scratch,
+            the merge is refused otherwise
+        """
+        if relative_path in self.outputs:
+            entry = self.outputs[relative_path]
+            output_size = os.path.getsize(output_file_path) if os.path.exists(output_file_path) else None
+            if output_size is not None and output_size >= entry['size']:
+                return
+            print 'Merged file %s is %s, merging it again from scratch' % (
+                output_file_path, 'missing' if output_size is None else 'shorter than recorded in the manifest')
+            instrumentation.count('reset_outputs')
+            self.outputs[relative_path] = self._get_empty_entry()
+            return
+        if os.path.exists(output_file_path) and not rebuild:
+            raise Exception('Merged file %s is not recorded in the merge manifest %s, merge with --rebuild to merge '
+                            'it again from scratch' % (output_file_path, self.manifest_path))
+        # an existing file is truncated before its inputs are appended
+        self.outputs[relative_path] = self._get_empty_entry()
+
+    def get_lines_numbers(self, output_path):
+        """
+        Get numbers of non-empty lines of output files recorded in the manifest, checked against files on disk.
+        Lines of files whose size differs from the recorded one are counted again, missing files have no lines.
+        :return: ordered dict of numbers of lines by relative paths of output files
+        """
+        lines_numbers = OrderedDict()
+        for relative_path, entry in sorted(self.outputs.iteritems()):
+            output_file_path = os.path.join(output_path, relative_path)
+            if not os.path.exists(output_file_path):
+                lines_numbers[relative_path] = 0
+            elif os.path.getsize(output_file_path) != entry['size']:
+                lines_numbers[relative_path] = count_non_empty_lines(output_file_path).lines_number
+            else:
+                lines_numbers[relative_path] = entry['lines_number']
+        return lines_numbers
+
+    @staticmethod
+    def _get_empty_entry():
+        return {'size': 0, 'lines_number': 0, 'line_counted': False, 'inputs': {}}
+
+
+def merge_output_file(args):
+    """
+    Append input files not merged yet to a single output file, counting its non-empty lines on the way.
+    Compressed input files are decompressed while they are copied. Inputs appended to a compressed output file
+    are written as a new gzip member or zstd frame, so an interrupted append can still be truncated.
+    :return: relative path of the output file, its updated manifest entry and input files changed after
+        they were merged
+    """
+    output_path, data_path, relative_path, input_paths, entry = args
+    output_file_path = os.path.join(output_path, relative_path)
+    if not os.path.exists(os.path.dirname(output_file_path)):
+        try:
             os.makedirs(os.path.dirname(output_file_path))
-        with open(output_file_path, "a") as output_file:
-            input_file_path = os.path.join(data_path, file_path)
-            lines_number = 0
-            with open(input_file_path, "r") as input_file:
-                for line in input_file:
-                    output_file.write(line)
-                    lines_number += 1
+        except OSError:
+            # created in the meantime by another worker
+            if not os.path.isdir(os.path.dirname(output_file_path)):
+                raise
+
+    changed_inputs = []
+    new_inputs = []
+    for input_path in input_paths:
+        input_info = get_input_info(os.path.join(data_path, input_path))
+        if input_path not in entry['inputs']:
+            new_inputs.append((input_path, input_info))
+        elif entry['inputs'][input_path] != input_info:
+            changed_inputs.append(input_path)
+    if not new_inputs:
+        return relative_path, entry, changed_inputs
+
+    counter = NonEmptyLinesCounter(entry['lines_number'], entry['line_counted'])
+    with open(output_file_path, 'ab') as output_file:
+        # drop the part of an append interrupted in a previous run
+        output_file.truncate(entry['size'])
+        writer = start_compressed_writer(output_file, get_compression(relative_path))
+        for input_path, input_info in new_inputs:
+            with open_result_file(os.path.join(data_path, input_path)) as input_file:
+                copy_counting_lines(input_file, writer, counter)
+            entry['inputs'][input_path] = input_info
+        writer.close()
+        entry['size'] = output_file.tell()
+    entry['lines_number'] = counter.lines_number
+    entry['line_counted'] = counter.line_counted
+    return relative_path, entry, changed_inputs
+
+
+def _merge_output_file_counting(args):
+    return instrumentation.call_counting(merge_output_file, args)
+
+
+def imap_in_pool(func, args_list, workers):
+    if workers <= 1:
+        for args in args_list:
+            yield func(args)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(func, args_list):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def merge_files(output_path, data_path, manifest, workers=1, compression=None, rebuild=False):
+    """
+    Append input files which are not recorded in the manifest to their output files.
+    Independent output files are merged in parallel and the manifest is saved regularly, so an interrupted
+    merge can be resumed by running it again.
+    :type manifest: MergeManifest
+    :param compression: compression of output files, 'gz', 'zst' or None
+    :param rebuild: whether existing output files missing from the manifest are merged again from scratch
+    :return: input files changed after they were merged
+    """
+    inputs_by_output = group_by_output_file(iter_files_paths(data_path), compression)
+    for relative_path in inputs_by_output:
+        manifest.start_output(os.path.join(output_path, relative_path), relative_path, rebuild)
+    manifest.save()
+
+    args_list = [(output_path, data_path, relative_path, input_paths, manifest.outputs[relative_path])
+                 for relative_path, input_paths in inputs_by_output.iteritems()]
+    all_changed_inputs = []
+    last_save_time = time.time()
+    for (relative_path, entry, changed_inputs), counters in imap_in_pool(_merge_output_file_counting, args_list,
+                                                                          workers):
+        instrumentation.add_counters(counters)
+        manifest.outputs[relative_path] = entry
+        all_changed_inputs.extend(changed_inputs)
+        if time.time() - last_save_time > MANIFEST_SAVE_INTERVAL:
+            manifest.save()
+            last_save_time = time.time()
+    manifest.save()
+    for input_path in all_changed_inputs:
+        print "Input file changed after it was merged: %s" % input_path
+    return all_changed_inputs
+
+
+def find_errors(lines_numbers):
+    errors = []
+    for file_path, lines_number in lines_numbers.iteritems():
+        if lines_number < MIN_LINES_NUMBER:
+            print "Error for path: %s" % file_path
+            errors.append({'path': file_path, 'lines_number': lines_number})
+    instrumentation.count('verified_files', len(lines_numbers))
+    instrumentation.count('verification_errors', len(errors))
+    return errors
 
 
 def verify_files(path):
-    files_paths = get_all_files_paths(path)
-    for file_path in files_paths:
-        with open(os.path.join(path, file_path), "r") as input_file:
-            lines_number = 0
-            for line in input_file:
-                if len(line.strip()) > 0:
-                    lines_number += 1
-            if lines_number < 100:
-                print "Error for path: %s" % file_path
+    with instrumentation.stage('verify'):
+        lines_numbers = OrderedDict((file_path, count_non_empty_lines(os.path.join(path, file_path)).lines_number)
+                                    for file_path in iter_files_paths(path))
+        return find_errors(lines_numbers)
+
+
+def save_report(report_path, files_number, errors, changed_inputs=()):
+    with open(report_path, 'w') as report_file:
+        json.dump({
+            'files_number': files_number,
+            'min_lines_number': MIN_LINES_NUMBER,
+            'errors_number': len(errors),
+            'errors': errors,
+            'changed_inputs': list(changed_inputs)
+        }, report_file, indent=2)
+
+
+def get_default_report_path(output_path):
+    return '%s-verification.json' % output_path.rstrip('/')
+
+
+def get_default_manifest_path(output_path):
+    return '%s-manifest.json' % output_path.rstrip('/')
 
 
-def merge_data(output_path, data_path):
-    merge_files(output_path, data_path)
-    verify_files(output_path)
+def merge_data(output_path, data_path, workers=1, report_path=None, manifest_path=None, compression=None,
+               rebuild=False):
+    manifest = MergeManifest(manifest_path or get_default_manifest_path(output_path))
+    with instrumentation.stage('merge', profiled=True):
+        changed_inputs = merge_files(output_path, data_path, manifest, workers, compression, rebuild)
+    lines_numbers = manifest.get_lines_numbers(output_path)
+    save_report(report_path or get_default_report_path(output_path), len(lines_numbers), find_errors(lines_numbers),
+                changed_inputs)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("output_path", help="output path")
     parser.add_argument("data_path", help="path to results of experiments")
+    add_merge_arguments(parser)
+    parser.add_argument("--metrics", help="output path of the JSON lines report of metrics of processing stages")
+    parser.add_argument("--profile", help="output path of cProfile stats of merging, suffixed with the stage name")
     args = parser.parse_args()
 
-    merge_data(args.output_path, args.data_path)
+    if args.metrics or args.profile:
+        instrumentation.enable(args.profile)
+    merge_data(args.output_path, args.data_path, args.workers, args.report, args.manifest, args.compression,
+               args.rebuild)
+    if args.metrics:
+        instrumentation.save_report(args.metrics)
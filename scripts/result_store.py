@@ -0,0 +1,300 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from aggregate_results import ColumnEncoder, DataType, DataUnit, DistributionType, MethodType, \
+    PathInterpreter, aggregate_records, get_bootstrap, get_results_filter, iter_data_records
+from instrumentation import instrumentation
+from utils import add_bootstrap_arguments, add_ingest_arguments, iter_files_paths, write_json_atomically
+
+
+STORE_VERSION = 3
+MANIFEST_FILE = 'store.json'
+SEGMENTS_DIR = 'segments'
+SEGMENT_FILE = 'segment.json'
+VALUES_FILE = 'values.npy'
+REPETITIONS_FILE = 'repetitions.npy'
+OFFSETS_FILE = 'offsets.npy'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+NUMERIC_COLUMNS = ['crit_number', 'alt_number']
+ENCODED_COLUMNS = ['data_type', 'distribution', 'pref_info', 'char_points', 'method_name']
+
+
+def encode_label(value):
+    if isinstance(value, (DataType, DistributionType, MethodType)):
+        return value.name
+    return value
+
+
+def decode_labels(column, labels):
+    if column == 'data_type':
+        return [DataType[label] for label in labels]
+    if column == 'distribution':
+        return [DistributionType[label] for label in labels]
+    if column == 'method_name':
+        return [MethodType[label] if label is not None else None for label in labels]
+    return [str(label) if isinstance(label, basestring) else label for label in labels]
+
+
+def get_file_hash(path):
+    file_hash = hashlib.sha1()
+    instrumentation.count('files_hashed')
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), ''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class ResultStoreWriter:
+    """
+    Collects parsed result files and saves them as a columnar segment of a result store.
+
+    A segment keeps the values of all its files in one float64 array, their repetitions of experiments in a parallel
+    int64 array, the value ranges of files in an offsets array and the parameters of files in numeric
+    or dictionary-encoded columns. All arrays are saved as .npy files,
+    so they can be memory-mapped when the segment is read.
+    """
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.paths = []
+        self.values = []
+        self.repetitions = []
+        self.counts = []
+        self.numeric_columns = dict((column, []) for column in NUMERIC_COLUMNS)
+        self.encoded_columns = dict((column, []) for column in ENCODED_COLUMNS)
+        self.encoders = dict((column, ColumnEncoder()) for column in ENCODED_COLUMNS)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, data_unit, values, repetitions):
+        self.paths.append(os.path.relpath(data_unit.path, self.data_path))
+        self.values.append(np.asarray(values, dtype=np.float64))
+        self.repetitions.append(np.asarray(repetitions, dtype=np.int64))
+        self.counts.append(len(values))
+        for column in NUMERIC_COLUMNS:
+            self.numeric_columns[column].append(getattr(data_unit, column))
+        for column in ENCODED_COLUMNS:
+            code = self.encoders[column].encode(encode_label(getattr(data_unit, column)))
+            self.encoded_columns[column].append(code)
+
+    def save(self, segment_path):
+        if not os.path.exists(segment_path):
+            os.makedirs(segment_path)
+        values = np.concatenate(self.values) if self.values else np.zeros(0, dtype=np.float64)
+        np.save(os.path.join(segment_path, VALUES_FILE), values)
+        np.save(os.path.join(segment_path, REPETITIONS_FILE),
+                np.concatenate(self.repetitions) if self.repetitions else np.zeros(0, dtype=np.int64))
+        np.save(os.path.join(segment_path, OFFSETS_FILE),
+                np.concatenate([[0], np.cumsum(self.counts)]).astype(np.int64))
+        for column in NUMERIC_COLUMNS:
+            np.save(os.path.join(segment_path, '%s.npy' % column),
+                    np.array(self.numeric_columns[column], dtype=np.int32))
+        for column in ENCODED_COLUMNS:
+            np.save(os.path.join(segment_path, '%s.npy' % column),
+                    np.array(self.encoded_columns[column], dtype=np.int32))
+        # metadata is written last, so an interrupted write does not leave a segment that looks complete
+        write_json_atomically(os.path.join(segment_path, SEGMENT_FILE), {
+            'paths': self.paths,
+            'dictionaries': dict((column, self.encoders[column].labels) for column in ENCODED_COLUMNS)
+        })
+
+
+class Segment:
+    """
+    Read access to a segment saved by ResultStoreWriter
+    """
+    def __init__(self, segment_path, mmap=True):
+        with open(os.path.join(segment_path, SEGMENT_FILE), 'r') as segment_file:
+            metadata = json.load(segment_file)
+        mmap_mode = 'r' if mmap else None
+        self.paths = metadata['paths']
+        self.values = np.load(os.path.join(segment_path, VALUES_FILE), mmap_mode=mmap_mode)
+        self.repetitions = np.load(os.path.join(segment_path, REPETITIONS_FILE), mmap_mode=mmap_mode)
+        self.offsets = np.load(os.path.join(segment_path, OFFSETS_FILE))
+        self.columns = {}
+        for column in NUMERIC_COLUMNS + ENCODED_COLUMNS:
+            self.columns[column] = np.load(os.path.join(segment_path, '%s.npy' % column))
+        self.dictionaries = dict((column, decode_labels(column, labels))
+                                 for column, labels in metadata['dictionaries'].iteritems())
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_values(self, idx):
+        return np.asarray(self.values[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def get_repetitions(self, idx):
+        return np.asarray(self.repetitions[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def get_data_unit(self, idx, data_path):
+        params = {}
+        for column in NUMERIC_COLUMNS:
+            params[column] = int(self.columns[column][idx])
+        for column in ENCODED_COLUMNS:
+            params[column] = self.dictionaries[column][self.columns[column][idx]]
+        return DataUnit(path=os.path.join(data_path, self.paths[idx]), **params)
+
+
+class ResultStore:
+    """
+    Result store made of segments written by successive ingests.
+
+    The manifest lists every ingested file with its size, modification time and content hash, together with
+    the segment and the position in the segment holding its parsed values. A file changed since the previous
+    ingest is parsed again into a new segment and its entry is moved there. Segments which are no longer
+    referenced by the manifest are removed.
+    """
+    def __init__(self, store_path, mmap=True):
+        self.store_path = store_path
+        self.mmap = mmap
+        manifest_path = os.path.join(store_path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                self.manifest = json.load(manifest_file)
+            if self.manifest['version'] != STORE_VERSION:
+                raise Exception('Unsupported result store version: %s' % self.manifest['version'])
+        else:
+            self.manifest = {'version': STORE_VERSION, 'data_path': None, 'next_segment': 0, 'files': {}}
+        self.files = self.manifest['files']
+        self._segments = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def data_path(self):
+        return self.manifest['data_path']
+
+    def get_segment(self, segment_name):
+        if segment_name not in self._segments:
+            segment_path = os.path.join(self.store_path, SEGMENTS_DIR, segment_name)
+            self._segments[segment_name] = Segment(segment_path, self.mmap)
+        return self._segments[segment_name]
+
+    def iter_records(self, path_filter=None):
+        """
+        Yield records of ingested files ordered by file path, so the order does not depend on the ingest history
+        :param path_filter: filter of paths of files, all files by default
+        :type path_filter: PathFilter
+        """
+        if self.data_path is None:
+            raise Exception('Result store not found in: %s' % self.store_path)
+        for path in sorted(self.files):
+            if path_filter is not None and not path_filter.accepts_path(path):
+                continue
+            file_info = self.files[path]
+            segment = self.get_segment(file_info['segment'])
+            yield segment.get_data_unit(file_info['index'], self.data_path), segment.get_values(file_info['index']), \
+                segment.get_repetitions(file_info['index'])
+
+    def add_segment(self, writer, files_info):
+        """
+        Save a new segment and point manifest entries of its files to it
+        :param writer: writer holding records of the new segment
+        :type writer: ResultStoreWriter
+        :param files_info: size, modification time and content hash of the files, by file path
+        """
+        segment_name = '%05d' % self.manifest['next_segment']
+        self.manifest['next_segment'] += 1
+        writer.save(os.path.join(self.store_path, SEGMENTS_DIR, segment_name))
+        for idx, path in enumerate(writer.paths):
+            self.files[path] = dict(files_info[path], segment=segment_name, index=idx)
+
+    def save(self):
+        write_json_atomically(os.path.join(self.store_path, MANIFEST_FILE), self.manifest)
+        self._remove_unused_segments()
+
+    def _remove_unused_segments(self):
+        segments_path = os.path.join(self.store_path, SEGMENTS_DIR)
+        if not os.path.exists(segments_path):
+            return
+        used_segments = set(file_info['segment'] for file_info in self.files.itervalues())
+        for segment_name in os.listdir(segments_path):
+            if segment_name not in used_segments:
+                self._segments.pop(segment_name, None)
+                shutil.rmtree(os.path.join(segments_path, segment_name))
+
+
+def ingest(store_path, data_path, workers=1, incremental=False):
+    """
+    Parse results of experiments into a result store
+    :param store_path: path to the result store
+    :param data_path: path to merged results of experiments
+    :param workers: number of processes parsing result files
+    :param incremental: whether only files added or changed since the previous ingest should be parsed
+    """
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+    store = ResultStore(store_path)
+    if not incremental or store.data_path != os.path.abspath(data_path):
+        store.files.clear()
+    store.manifest['data_path'] = os.path.abspath(data_path)
+
+    interpreter = PathInterpreter(data_path)
+    files_info = {}
+    paths_to_parse = []
+    with instrumentation.stage('scan'):
+        for file_path in iter_files_paths(data_path, get_results_filter()):
+            if interpreter.interpret(file_path) is None:
+                continue
+            stat = os.stat(os.path.join(data_path, file_path))
+            file_info = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            stored_info = store.files.get(file_path)
+            if stored_info is not None and stored_info['size'] == file_info['size']:
+                if stored_info['mtime'] != file_info['mtime']:
+                    # the file was touched, so it is compared by content
+                    instrumentation.count('files_rehashed')
+                    file_info['hash'] = get_file_hash(os.path.join(data_path, file_path))
+                if file_info.get('hash', stored_info['hash']) == stored_info['hash']:
+                    instrumentation.count('files_reused')
+                    stored_info['mtime'] = file_info['mtime']
+                    files_info[file_path] = stored_info
+                    continue
+            if 'hash' not in file_info:
+                file_info['hash'] = get_file_hash(os.path.join(data_path, file_path))
+            files_info[file_path] = file_info
+            paths_to_parse.append(file_path)
+            instrumentation.count('files_to_ingest')
+
+    removed_paths = [path for path in store.files if path not in files_info]
+    for path in removed_paths:
+        del store.files[path]
+
+    if paths_to_parse:
+        with instrumentation.stage('ingest', profiled=True):
+            writer = ResultStoreWriter(data_path)
+            for data_unit, values, repetitions in iter_data_records(data_path, workers, paths_to_parse):
+                writer.add(data_unit, values, repetitions)
+            store.add_segment(writer, files_info)
+    store.save()
+    print 'Ingested files: %d, unchanged files: %d, removed files: %d' % (
+        len(paths_to_parse), len(files_info) - len(paths_to_parse), len(removed_paths))
+
+
+def aggregate_store(output_path, store_path, workers=1, bootstrap=None):
+    aggregate_records(output_path, ResultStore(store_path).iter_records(), workers, bootstrap=bootstrap)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    ingest_parser = subparsers.add_parser("ingest", help="convert merged results into a result store")
+    ingest_parser.add_argument("store_path", help="output path of the result store")
+    ingest_parser.add_argument("data_path", help="path to merged results of experiments")
+    add_ingest_arguments(ingest_parser)
+    aggregate_parser = subparsers.add_parser("aggregate", help="generate charts and statistics from a result store")
+    aggregate_parser.add_argument("output_path", help="output path")
+    aggregate_parser.add_argument("store_path", help="path to the result store")
+    aggregate_parser.add_argument("--workers", type=int, default=1,
+                                  help="number of processes rendering charts (default: %(default)s)")
+    add_bootstrap_arguments(aggregate_parser)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        ingest(args.store_path, args.data_path, args.workers, args.incremental)
+    else:
+        aggregate_store(args.output_path, args.store_path, args.workers, get_bootstrap(args))
@@ -0,0 +1,250 @@
+"""
+Command line interface of all tools processing results of experiments.
+
+Subcommands take the arguments of the scripts they run, added by helpers of utils.py. Each subcommand imports
+only the scripts it runs, which load the plotting and statistics libraries only when charts are rendered or tests
+computed, so quick commands like merge or verify do not pay for loading numpy or the aggregations.
+"""
+import argparse
+import os
+import sys
+from instrumentation import instrumentation
+from utils import add_bootstrap_arguments, add_ingest_arguments, add_merge_arguments, add_path_filter_arguments, \
+    add_preview_arguments, add_rows_arguments, add_sharded_arguments, add_tests_arguments, add_watch_arguments
+
+
+def merge(args):
+    from merge_results import merge_data
+    merge_data(args.output_path, args.data_path, args.workers, args.report, args.manifest, args.compression,
+               args.rebuild)
+
+
+def verify(args):
+    from merge_results import save_report, verify_files
+    from utils import get_all_files_paths
+    errors = verify_files(args.path)
+    if args.report:
+        save_report(args.report, len(get_all_files_paths(args.path)), errors)
+    return 1 if errors else 0
+
+
+def ingest_results(args):
+    from result_store import ingest
+    ingest(args.store_path, args.data_path, args.workers, args.incremental)
+
+
+def get_records(source_path, workers, path_filter, all_rows=False, sharded=False, sampling=None):
+    """
+    Get records of merged results of experiments, of shards read as merged results or of a result store
+    :param source_path: path to merged results of experiments, to shards of results or to a result store
+    :param workers: number of processes parsing result files
+    :param path_filter: filter of paths of result files
+    :param all_rows: whether all rows of result files are read instead of the first ROWS_NUMBER rows
+    :param sharded: whether source_path is a directory of shards, read as merged results without merging them
+    :param sampling: sampling of result files of a preview
+    :return: generator of (DataUnit, values, repetitions) tuples
+    """
+    import aggregate_results
+    from result_store import MANIFEST_FILE, ResultStore
+    if os.path.exists(os.path.join(source_path, MANIFEST_FILE)):
+        if sampling is not None:
+            raise Exception('A result store is read whole, previews sample merged results or shards')
+        if sharded:
+            raise Exception('A result store is not made of shards, read it without --sharded')
+        if all_rows:
+            raise Exception('A result store keeps only the first rows of result files, read merged results instead')
+        return ResultStore(source_path).iter_records(path_filter)
+    return aggregate_results.iter_data_records(source_path, workers, path_filter=path_filter,
+                                               rows_number=None if all_rows else aggregate_results.ROWS_NUMBER,
+                                               sharded=sharded, sampling=sampling)
+
+
+def aggregate(args, aggregation_names):
+    import aggregate_results
+    aggregation_classes = [getattr(aggregate_results, name) for name in aggregation_names]
+    path_filter = aggregate_results.get_results_filter(args.distributions, args.matrix_sizes, args.preferences,
+                                                       args.models, args.sharded)
+    sampling = aggregate_results.get_sampling(args)
+    records = get_records(args.source_path, args.workers, path_filter, args.all_rows, args.sharded, sampling)
+    aggregate_results.aggregate_records(args.output_path, records, args.workers, aggregation_classes,
+                                        aggregate_results.get_bootstrap(args), sampling)
+
+
+def charts(args):
+    aggregate(args, ['AggregationByCharPoints', 'AggregationByMethods'])
+
+
+def wilcoxon(args):
+    aggregate(args, ['WilcoxonForMethods'])
+
+
+def friedman(args):
+    aggregate(args, ['FriedmanForMethods'])
+
+
+def summary(args):
+    aggregate(args, ['SummaryAggregationByMethod'])
+
+
+def query(args):
+    import aggregate_results
+    path_filter = aggregate_results.get_results_filter(args.distributions, args.matrix_sizes, args.preferences,
+                                                       args.models, args.sharded)
+    where = {}
+    for condition in args.where or []:
+        dimension, labels = condition.split('=', 1)
+        where[dimension] = [aggregate_results.parse_label(dimension, label) for label in labels.split(',')]
+    records = get_records(args.source_path, args.workers, path_filter, args.all_rows, args.sharded)
+    table = aggregate_results.load_results_table(records)
+    bootstrap = aggregate_results.get_bootstrap(args)
+    means = table.mean(args.by, where)
+    intervals = table.mean_intervals(args.by, bootstrap, where) if bootstrap is not None else None
+    print ','.join(args.by + ['mean'] + (['ci_low', 'ci_high'] if intervals is not None else []))
+    for labels, mean in means.iteritems():
+        fields = [aggregate_results.format_label(label) for label in labels] + ['%f' % mean]
+        if intervals is not None:
+            fields.extend('%f' % bound for bound in intervals[labels])
+        print ','.join(fields)
+
+
+def map_results(args):
+    import aggregate_results
+    from shard_aggregation import map_shards
+    map_shards(args.shards_paths, args.partials_path, args.workers,
+               aggregate_results.get_results_filter(args.distributions, args.matrix_sizes, args.preferences,
+                                                    args.models),
+               aggregate_results.get_rows_number(args))
+
+
+def reduce_partials(args):
+    import aggregate_results
+    from shard_aggregation import aggregate_partials
+    aggregate_partials(args.output_path, args.partials_paths, args.workers,
+                       aggregate_results.get_aggregation_classes(args.friedman), aggregate_results.get_bootstrap(args))
+
+
+def watch_results(args):
+    import aggregate_results
+    from watch_results import watch
+    path_filter = aggregate_results.get_results_filter(args.distributions, args.matrix_sizes, args.preferences,
+                                                       args.models)
+    try:
+        watch(args.output_path, args.data_path, args.interval, path_filter,
+              aggregate_results.get_rows_number(args), args.workers,
+              aggregate_results.get_aggregation_classes(args.friedman), aggregate_results.get_bootstrap(args),
+              args.polls)
+    except KeyboardInterrupt:
+        pass
+
+
+def add_aggregation_parser(subparsers, name, help_text, preview=False):
+    aggregation_parser = subparsers.add_parser(name, help=help_text)
+    aggregation_parser.add_argument("output_path", help="output path")
+    aggregation_parser.add_argument("source_path", help="path to merged results of experiments or to a result store")
+    aggregation_parser.add_argument("--workers", type=int, default=1,
+                                    help="number of processes parsing result files and rendering charts "
+                                         "(default: %(default)s)")
+    add_sharded_arguments(aggregation_parser)
+    add_rows_arguments(aggregation_parser)
+    add_path_filter_arguments(aggregation_parser)
+    add_bootstrap_arguments(aggregation_parser)
+    if preview:
+        add_preview_arguments(aggregation_parser)
+    else:
+        aggregation_parser.set_defaults(preview=None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metrics", help="output path of the JSON lines report of metrics of processing stages")
+    parser.add_argument("--profile", help="output path of cProfile stats of the main stage of the command, suffixed "
+                                               "with the stage name")
+    subparsers = parser.add_subparsers(dest="command")
+
+    merge_parser = subparsers.add_parser("merge", help="merge results of experiments")
+    merge_parser.add_argument("output_path", help="output path")
+    merge_parser.add_argument("data_path", help="path to results of experiments")
+    add_merge_arguments(merge_parser)
+
+    verify_parser = subparsers.add_parser("verify", help="check that merged files have enough results, "
+                                                         "exit with status 1 if some have not")
+    verify_parser.add_argument("path", help="path to merged results of experiments")
+    verify_parser.add_argument("--report", help="path of the JSON verification report")
+
+    ingest_parser = subparsers.add_parser("ingest", help="convert merged results into a result store")
+    ingest_parser.add_argument("store_path", help="output path of the result store")
+    ingest_parser.add_argument("data_path", help="path to merged results of experiments")
+    add_ingest_arguments(ingest_parser)
+
+    add_aggregation_parser(subparsers, "charts", "plot charts by characteristic points and by methods", preview=True)
+    add_aggregation_parser(subparsers, "wilcoxon", "compute Wilcoxon tests comparing methods")
+    add_aggregation_parser(subparsers, "friedman", "compute Friedman tests comparing all methods at once, "
+                                                   "with Nemenyi and Holm post-hoc analysis")
+    add_aggregation_parser(subparsers, "summary", "plot summary charts of methods", preview=True)
+
+    dimensions_help = ', '.join(['data_type', 'distribution', 'crit_number', 'alt_number', 'pref_info', 'char_points',
+                                 'method_name'])
+    query_parser = subparsers.add_parser("query", help="print means of results grouped by the given parameters")
+    query_parser.add_argument("source_path", help="path to merged results of experiments or to a result store")
+    query_parser.add_argument("--by", nargs='+', required=True,
+                              help="parameters grouping the results, any of: %s" % dimensions_help)
+    query_parser.add_argument("--where", nargs='+', metavar="PARAMETER=LABEL[,LABEL...]",
+                              help="accepted labels of parameters, enumerations by name or value, "
+                                   "e.g. data_type=eps distribution=skew_normal char_points=5")
+    query_parser.add_argument("--workers", type=int, default=1,
+                              help="number of processes parsing result files (default: %(default)s)")
+    add_sharded_arguments(query_parser)
+    add_rows_arguments(query_parser)
+    add_path_filter_arguments(query_parser)
+    add_bootstrap_arguments(query_parser)
+
+    map_parser = subparsers.add_parser("map", help="read shards of results of experiments into small partials, "
+                                                   "to aggregate them without merging the shards")
+    map_parser.add_argument("partials_path", help="output directory of partials, named after the shards")
+    map_parser.add_argument("shards_paths", nargs='+', help="paths to shards of results of experiments")
+    map_parser.add_argument("--workers", type=int, default=1,
+                            help="number of processes mapping shards (default: %(default)s)")
+    add_rows_arguments(map_parser)
+    add_path_filter_arguments(map_parser)
+
+    reduce_parser = subparsers.add_parser("reduce", help="plot charts and compute tests of results combined from "
+                                                         "partials of all shards")
+    reduce_parser.add_argument("output_path", help="output path")
+    reduce_parser.add_argument("partials_paths", nargs='+', help="paths to partials of all shards")
+    reduce_parser.add_argument("--workers", type=int, default=1,
+                               help="number of processes rendering charts (default: %(default)s)")
+    add_tests_arguments(reduce_parser)
+    add_bootstrap_arguments(reduce_parser)
+
+    watch_parser = subparsers.add_parser("watch", help="refresh charts and tests as rows are appended to results "
+                                                       "of experiments in progress")
+    watch_parser.add_argument("output_path", help="output path")
+    watch_parser.add_argument("data_path", help="path to results of experiments, in the layout of merged results")
+    add_watch_arguments(watch_parser)
+    watch_parser.add_argument("--workers", type=int, default=1,
+                              help="number of processes rendering charts (default: %(default)s)")
+    add_rows_arguments(watch_parser)
+    add_tests_arguments(watch_parser)
+    add_path_filter_arguments(watch_parser)
+    add_bootstrap_arguments(watch_parser)
+
+    args = parser.parse_args()
+    commands = {
+        "merge": merge,
+        "verify": verify,
+        "ingest": ingest_results,
+        "charts": charts,
+        "wilcoxon": wilcoxon,
+        "friedman": friedman,
+        "summary": summary,
+        "query": query,
+        "map": map_results,
+        "reduce": reduce_partials,
+        "watch": watch_results
+    }
+    if args.metrics or args.profile:
+        instrumentation.enable(args.profile)
+    status = commands[args.command](args)
+    if args.metrics:
+        instrumentation.save_report(args.metrics)
+    sys.exit(status)
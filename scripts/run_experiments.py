@@ -0,0 +1,294 @@
+"""
+Scheduler of experiments of R/experiments.R, run as parallel Rscript processes.
+
+The grid of experiments is split into units of a single repetition of a distribution, matrix size, number of
+preferences and preference model. Every repetition writes into its own shard directory, where units write
+into distinct model directories, so the shards are merged by merge_results.py into the layout written
+by launchAllExperiments.
+
+Units are started longest first, with durations estimated from units of the same configuration finished
+in previous runs. Finished units are recorded in a schedule file, so an interrupted run can be resumed
+by running it again.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+from experiments_grid import CHAR_POINTS, DISTRIBUTIONS, MATRIX_SIZES, PREFERENCES, get_preferences
+from instrumentation import instrumentation
+from merge_results import merge_data
+from utils import COMPRESSION_SUFFIXES, write_json_atomically
+
+
+SCHEDULE_VERSION = 1
+DISCRETIZATION_METHODS = ['KERNEL_DENSITY_ESTIMATION', 'GHADERI_DISCRETIZATION']
+MODELS = ['SEGMENTED-%d-%s' % (char_points_number, method)
+          for method in DISCRETIZATION_METHODS for char_points_number in CHAR_POINTS]
+R_SETUP = 'library(rorranking)'
+
+
+def get_model_expression(model):
+    """
+    Get R expression of a preference model given by the name of its directory, e.g. SEGMENTED-3-K_MEANS
+    """
+    if not model.startswith('SEGMENTED-'):
+        return "list(func.type='%s')" % model
+    func_type, char_points_number, method = model.split('-', 2)
+    return "list(func.type='%s', charact.points.number=%d, discretization.method='%s')" % (
+        func_type, int(char_points_number), method)
+
+
+class ExperimentUnit:
+    """
+    Single repetition of experiments of a distribution, matrix size, number of preferences and preference model
+    """
+    def __init__(self, repetition, distribution, matrix_size, preferences, model):
+        self.repetition = repetition
+        self.distribution = distribution
+        self.matrix_size = matrix_size
+        self.preferences = preferences
+        self.model = model
+
+    def get_config(self):
+        return '/'.join([self.distribution, self.matrix_size, self.preferences, self.model])
+
+    def get_name(self):
+        return '%s/%s' % (self.get_shard(), self.get_config())
+
+    def get_shard(self):
+        return 'rep-%04d' % self.repetition
+
+    def get_perfs_seed(self, seed):
+        """
+        Seed of performances, shared by units of the same repetition, distribution and matrix size
+        """
+        return zlib.crc32('%d/%d/%s/%s' % (seed, self.repetition, self.distribution, self.matrix_size)) & 0x7fffffff
+
+    def get_expression(self, shards_path, seed, pref_repetitions_expr, pref_repetitions_rbst):
+        crits_number, alts_number = self.matrix_size.split('x')
+        preferences_number = 'NULL' if self.preferences == 'ranking' else self.preferences[len('pref-'):]
+        return "launchExperimentsUnit('%s', %d, %d, '%s', %s, %s, %d, %d, %d)" % (
+            os.path.join(shards_path, self.get_shard()), int(crits_number), int(alts_number), self.distribution,
+            preferences_number, get_model_expression(self.model), pref_repetitions_expr, pref_repetitions_rbst,
+            self.get_perfs_seed(seed))
+
+    def get_estimated_cost(self):
+        """
+        Relative cost of the unit, growing with the size of linear programs solved by its experiments
+        """
+        crits_number, alts_number = [int(number) for number in self.matrix_size.split('x')]
+        if self.model.startswith('SEGMENTED-'):
+            char_points_number = int(self.model.split('-')[1])
+        elif self.model == 'GENERAL':
+            char_points_number = alts_number
+        else:
+            char_points_number = 2
+        preferences_number = alts_number - 1 if self.preferences == 'ranking' else int(self.preferences[len('pref-'):])
+        return crits_number * char_points_number * alts_number * (alts_number + preferences_number)
+
+
+def get_units(repetitions, distributions=DISTRIBUTIONS, matrix_sizes=MATRIX_SIZES, preferences=PREFERENCES,
+              models=MODELS):
+    """
+    Get units of the grid of experiments, with preferences of every matrix size selected by get_preferences
+    as launchAllExperimentsForPerfs selects them
+    """
+    return [ExperimentUnit(repetition, distribution, matrix_size, pref, model)
+            for repetition in xrange(repetitions)
+            for distribution in distributions
+            for matrix_size in matrix_sizes
+            for pref in get_preferences(matrix_size, preferences)
+            for model in models]
+
+
+class Schedule:
+    """
+    Record of finished units and of their durations
+    """
+    def __init__(self, schedule_path):
+        self.schedule_path = schedule_path
+        if os.path.exists(schedule_path):
+            with open(schedule_path, 'r') as schedule_file:
+                schedule = json.load(schedule_file)
+            if schedule['version'] != SCHEDULE_VERSION:
+                raise Exception('Unsupported schedule version: %s' % schedule['version'])
+            self.durations = schedule['durations']
+        else:
+            self.durations = {}
+
+    def save(self):
+        write_json_atomically(self.schedule_path, {'version': SCHEDULE_VERSION, 'durations': self.durations})
+
+    def is_finished(self, unit):
+        return unit.get_name() in self.durations
+
+    def finish(self, unit, duration):
+        self.durations[unit.get_name()] = duration
+
+    def order_longest_first(self, units):
+        """
+        Sort units by estimated duration, the mean duration of finished units of the same configuration,
+        or the estimated cost scaled by durations of all finished units if no such unit has finished
+        """
+        config_durations = {}
+        for name, duration in self.durations.iteritems():
+            config_durations.setdefault(name.split('/', 1)[1], []).append(duration)
+        finished_costs = sum(ExperimentUnit(0, *config.split('/')).get_estimated_cost() * len(durations)
+                             for config, durations in config_durations.iteritems())
+        seconds_per_cost = sum(self.durations.itervalues()) / finished_costs if finished_costs else 1.0
+
+        def get_estimated_duration(unit):
+            durations = config_durations.get(unit.get_config())
+            if durations:
+                return sum(durations) / len(durations)
+            return unit.get_estimated_cost() * seconds_per_cost
+        return sorted(units, key=get_estimated_duration, reverse=True)
+
+
+class ExperimentsRunner:
+    """
+    Runs units as Rscript processes, each unit is retried after removing its partial results
+    """
+    def __init__(self, shards_path, logs_path, seed=0, pref_repetitions_expr=100, pref_repetitions_rbst=100,
+                 retries=2, rscript='Rscript', r_setup=R_SETUP):
+        self.shards_path = shards_path
+        self.logs_path = logs_path
+        self.seed = seed
+        self.pref_repetitions_expr = pref_repetitions_expr
+        self.pref_repetitions_rbst = pref_repetitions_rbst
+        self.retries = retries
+        self.rscript = rscript
+        self.r_setup = r_setup
+
+    def run_unit(self, unit):
+        """
+        :return: the unit, whether it succeeded, duration of its last attempt and number of its attempts
+        """
+        unit_path = os.path.join(self.shards_path, unit.get_name())
+        log_path = os.path.join(self.logs_path, unit.get_name().replace('/', '_') + '.log')
+        expression = '%s; %s' % (self.r_setup, unit.get_expression(self.shards_path, self.seed,
+                                                                   self.pref_repetitions_expr,
+                                                                   self.pref_repetitions_rbst))
+        for attempt in xrange(1, self.retries + 2):
+            if os.path.exists(unit_path):
+                # results of an interrupted or failed attempt
+                shutil.rmtree(unit_path)
+            start_time = time.time()
+            with open(log_path, 'a') as log_file:
+                status = subprocess.call([self.rscript, '-e', expression], stdout=log_file,
+                                         stderr=subprocess.STDOUT)
+            if status == 0:
+                return unit, True, time.time() - start_time, attempt
+        return unit, False, time.time() - start_time, attempt
+
+
+def run_units(units, runner, schedule, workers=1):
+    """
+    Run units not finished yet in parallel, longest first
+    :type runner: ExperimentsRunner
+    :type schedule: Schedule
+    :return: failed units
+    """
+    if not os.path.exists(runner.logs_path):
+        os.makedirs(runner.logs_path)
+    units = schedule.order_longest_first([unit for unit in units if not schedule.is_finished(unit)])
+    failed_units = []
+    pool = ThreadPool(workers)
+    try:
+        for unit, succeeded, duration, attempts in pool.imap_unordered(runner.run_unit, units):
+            instrumentation.count('unit_attempts', attempts)
+            if succeeded:
+                schedule.finish(unit, duration)
+                schedule.save()
+                instrumentation.count('finished_units')
+                print 'Finished unit: %s, time: %.1f s' % (unit.get_name(), duration)
+            else:
+                failed_units.append(unit)
+                instrumentation.count('failed_units')
+                print 'Failed unit: %s, attempts: %d' % (unit.get_name(), attempts)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failed_units
+
+
+def get_default_schedule_path(shards_path):
+    return '%s-schedule.json' % shards_path.rstrip('/')
+
+
+def get_default_logs_path(shards_path):
+    return '%s-logs' % shards_path.rstrip('/')
+
+
+def run_experiments(shards_path, merged_path, units, runner, workers=1, schedule_path=None, compression=None):
+    """
+    Run units of experiments and merge their shards once all of them have finished
+    :param shards_path: directory of shards written by units
+    :param merged_path: output path of merged results, shards are not merged if None
+    :type runner: ExperimentsRunner
+    :param compression: compression of merged files, 'gz', 'zst' or None
+    :return: failed units
+    """
+    schedule = Schedule(schedule_path or get_default_schedule_path(shards_path))
+    with instrumentation.stage('experiments'):
+        failed_units = run_units(units, runner, schedule, workers)
+    if failed_units:
+        print 'Shards are not merged, failed units: %d' % len(failed_units)
+    elif merged_path is not None:
+        merge_data(merged_path, shards_path, workers, compression=compression)
+    return failed_units
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("shards_path", help="output path of shards of results of experiments")
+    parser.add_argument("merged_path", nargs='?', help="output path of merged results, shards are merged once "
+                                                       "all units have finished")
+    parser.add_argument("--repetitions", type=int, default=1,
+                        help="number of generated performance matrices (default: %(default)s)")
+    parser.add_argument("--distributions", nargs='+', default=DISTRIBUTIONS, choices=DISTRIBUTIONS)
+    parser.add_argument("--matrix-sizes", nargs='+', default=MATRIX_SIZES, help="CxA sizes of performance matrices")
+    parser.add_argument("--preferences", nargs='+', default=PREFERENCES, help="pref-N or ranking")
+    parser.add_argument("--models", nargs='+', default=MODELS,
+                        help="LINEAR, GENERAL or SEGMENTED-<characteristic points>-<discretization method>")
+    parser.add_argument("--pref-repetitions-expr", type=int, default=100,
+                        help="number of preferences sets of expressiveness experiments (default: %(default)s)")
+    parser.add_argument("--pref-repetitions-rbst", type=int, default=100,
+                        help="number of preferences sets of robustness experiments (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of generated performances (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of parallel Rscript processes (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="number of retries of a failed unit (default: %(default)s)")
+    parser.add_argument("--rscript", default='Rscript', help="Rscript executable (default: %(default)s)")
+    parser.add_argument("--r-setup", default=R_SETUP,
+                        help="R expression loading the package before every unit (default: %(default)s)")
+    parser.add_argument("--schedule", help="path of the schedule of finished units "
+                                           "(default: <shards_path>-schedule.json)")
+    parser.add_argument("--logs", help="directory of logs of units (default: <shards_path>-logs)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSION_SUFFIXES),
+                        help="compress merged files with gzip or zstd")
+    parser.add_argument("--metrics", help="output path of the JSON lines report of metrics of processing stages")
+    args = parser.parse_args()
+
+    if args.metrics:
+        instrumentation.enable()
+    experiments_runner = ExperimentsRunner(os.path.abspath(args.shards_path),
+                                           args.logs or get_default_logs_path(args.shards_path), args.seed,
+                                           args.pref_repetitions_expr, args.pref_repetitions_rbst, args.retries,
+                                           args.rscript, args.r_setup)
+    all_failed_units = run_experiments(args.shards_path, args.merged_path,
+                                       get_units(args.repetitions, args.distributions, args.matrix_sizes,
+                                                 args.preferences, args.models),
+                                       experiments_runner, args.workers, args.schedule, args.compression)
+    if args.metrics:
+        instrumentation.save_report(args.metrics)
+    sys.exit(1 if all_failed_units else 0)
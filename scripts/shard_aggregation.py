@@ -0,0 +1,240 @@
+"""
+Aggregation of shards of results of experiments without merging them first.
+
+The map step reads a single shard, where it was written, into a partial: the values of the rows of every result
+file that aggregations may read, saved in a single compressed file. The reduce step combines partials of all shards
+as merge_results.py would combine the shards, and runs aggregations on them, so its charts and CSV files are
+the same as of aggregate_results.py run on merged results.
+"""
+import argparse
+from collections import OrderedDict
+import json
+import os
+import numpy as np
+from aggregate_results import PathInterpreter, aggregate_records, get_aggregation_classes, get_bootstrap, \
+    get_results_filter, get_repetitions, get_row_sizes, get_rows_number, parse_data_rows, read_rows_counting_na, \
+    skips_na
+from instrumentation import instrumentation
+from merge_results import imap_in_pool
+from utils import ROWS_NUMBER, add_bootstrap_arguments, add_path_filter_arguments, add_rows_arguments, \
+    add_tests_arguments, iter_files_paths, strip_compression_suffix
+
+
+PARTIAL_VERSION = 2
+PARTIAL_SUFFIX = '.partial.npz'
+
+
+class ShardPartial:
+    """
+    Rows of result files of a single shard, as read by aggregations: the first rows_number rows of every file,
+    without rows containing NA in files which may contain them.
+
+    Bootstrap intervals resample values and Wilcoxon and Friedman tests pair them, so sums and counts of values
+    are not enough. A partial keeps the values of the rows instead, which bounds its size by rows_number rows
+    per file whatever the size of the shard. Rows of a merged file may come from several shards, so numbers
+    of values of every row are kept to take the rows up to rows_number, and indices of rows in the file of the shard
+    to number repetitions of experiments as in the merged file.
+    """
+    def __init__(self, shard_name, rows_number=ROWS_NUMBER):
+        """
+        :param shard_name: name of the shard directory, which sets the order of shards in merged files
+        :param rows_number: number of rows read from every file, all rows if None
+        """
+        self.shard_name = shard_name
+        self.rows_number = rows_number
+        self.files = OrderedDict()
+
+    def add_file(self, path, row_sizes, row_indices, values, na_rows):
+        """
+        :param path: path of the file relative to the shard, without compression suffix
+        :param row_sizes: numbers of values of every row
+        :param row_indices: indices of the rows in the file
+        :param values: values of all rows
+        :param na_rows: number of skipped rows containing NA
+        """
+        self.files[path] = (np.asarray(row_sizes, dtype=np.int32), np.asarray(row_indices, dtype=np.int64),
+                            np.asarray(values, dtype=np.float64), na_rows)
+
+    def save(self, partial_path):
+        tmp_path = '%s.tmp' % partial_path
+        meta = {'version': PARTIAL_VERSION, 'shard_name': self.shard_name, 'rows_number': self.rows_number}
+        files = self.files.values()
+        with open(tmp_path, 'wb') as partial_file:
+            np.savez_compressed(
+                partial_file, meta=np.array(json.dumps(meta)), paths=np.array(self.files.keys(), dtype=str),
+                rows_numbers=np.array([len(row_sizes) for row_sizes, _, _, _ in files], dtype=np.int64),
+                values_numbers=np.array([len(values) for _, _, values, _ in files], dtype=np.int64),
+                row_sizes=np.concatenate([row_sizes for row_sizes, _, _, _ in files] or [np.zeros(0, np.int32)]),
+                row_indices=np.concatenate([row_indices for _, row_indices, _, _ in files]
+                                           or [np.zeros(0, np.int64)]),
+                values=np.concatenate([values for _, _, values, _ in files] or [np.zeros(0)]),
+                na_rows=np.array([na_rows for _, _, _, na_rows in files], dtype=np.int64))
+        os.rename(tmp_path, partial_path)
+
+    @staticmethod
+    def load(partial_path):
+        arrays = np.load(partial_path)
+        meta = json.loads(str(arrays['meta']))
+        if meta['version'] != PARTIAL_VERSION:
+            raise Exception('Unsupported partial version: %s' % meta['version'])
+        partial = ShardPartial(meta['shard_name'], meta['rows_number'])
+        row_sizes = arrays['row_sizes']
+        row_indices = arrays['row_indices']
+        values = arrays['values']
+        rows_numbers = arrays['rows_numbers']
+        values_numbers = arrays['values_numbers']
+        for path, rows_end, rows_number, values_end, values_number, na_rows in zip(
+                arrays['paths'], np.cumsum(rows_numbers), rows_numbers, np.cumsum(values_numbers), values_numbers,
+                arrays['na_rows']):
+            partial.files[str(path)] = (row_sizes[rows_end - rows_number:rows_end],
+                                        row_indices[rows_end - rows_number:rows_end],
+                                        values[values_end - values_number:values_end], int(na_rows))
+        return partial
+
+
+def get_partial_path(partials_path, shard_name):
+    return os.path.join(partials_path, shard_name + PARTIAL_SUFFIX)
+
+
+def map_shard(shard_path, partial_path, path_filter=None, rows_number=ROWS_NUMBER):
+    """
+    Read result files of a shard into a partial
+    :param shard_path: path to a shard of results of experiments, as written by a single run of experiments
+    :param partial_path: output path of the partial
+    :type path_filter: utils.PathFilter
+    :param rows_number: number of rows read from every file, all rows if None
+    :return: number of files of the partial
+    """
+    partial = ShardPartial(os.path.basename(shard_path.rstrip('/')), rows_number)
+    interpreter = PathInterpreter(shard_path)
+    for file_path in iter_files_paths(shard_path, path_filter or get_results_filter()):
+        data_unit = interpreter.interpret(file_path)
+        if data_unit is None:
+            continue
+        rows, row_indices, na_rows = read_rows_counting_na(data_unit.path, skips_na(data_unit.data_type), rows_number)
+        values = parse_data_rows(rows, data_unit.data_type, data_unit.path)
+        partial.add_file(strip_compression_suffix(file_path), get_row_sizes(rows), row_indices, values, na_rows)
+    partial.save(partial_path)
+    return len(partial.files)
+
+
+def _map_shard(args):
+    return map_shard(*args)
+
+
+def _map_shard_counting(args):
+    return instrumentation.call_counting(_map_shard, args)
+
+
+def map_shards(shards_paths, partials_path, workers=1, path_filter=None, rows_number=ROWS_NUMBER):
+    """
+    Map every shard into a partial named after the shard, shards are mapped in parallel
+    """
+    if not os.path.exists(partials_path):
+        os.makedirs(partials_path)
+    args_list = [(shard_path, get_partial_path(partials_path, os.path.basename(shard_path.rstrip('/'))), path_filter,
+                  rows_number) for shard_path in shards_paths]
+    with instrumentation.stage('map', profiled=True):
+        for files_number, counters in imap_in_pool(_map_shard_counting, args_list, workers):
+            instrumentation.add_counters(counters)
+            instrumentation.count('mapped_shards')
+            print 'Mapped files: %d' % files_number
+
+
+def reduce_partials(partials):
+    """
+    Combine partials of shards into records of merged files. Rows of a file are taken from shards in the order
+    of their names, in which merge_results.py appends them, up to the number of rows the partials were mapped with.
+    Rows of a shard follow all rows of the file in previous shards, which were read whole when rows of the shard
+    are needed, so repetitions of experiments and skipped NA rows are numbered and counted as in the merged file.
+    :param partials: list of ShardPartial
+    :return: list of (DataUnit, values, repetitions) tuples in the order of a walk of merged results
+    """
+    if len(set(partial.rows_number for partial in partials)) > 1:
+        raise Exception('Partials were mapped with different numbers of rows')
+    if len(set(partial.shard_name for partial in partials)) < len(partials):
+        raise Exception('Partials of the same shard given more than once')
+    partials = sorted(partials, key=lambda partial: partial.shard_name)
+    rows_number = partials[0].rows_number if partials else ROWS_NUMBER
+    paths = set()
+    for partial in partials:
+        paths.update(partial.files)
+
+    interpreter = PathInterpreter('')
+    records = []
+    na_rows_number = 0
+    for path in sorted(paths, key=lambda path: path.split('/')):
+        values_parts = []
+        repetitions_parts = []
+        read_rows_number = 0
+        first_row = 0
+        for partial in partials:
+            if path not in partial.files:
+                continue
+            row_sizes, row_indices, values, na_rows = partial.files[path]
+            taken_rows = len(row_sizes) if rows_number is None else min(len(row_sizes), rows_number - read_rows_number)
+            values_parts.append(values[:row_sizes[:taken_rows].sum()])
+            repetitions_parts.append(get_repetitions(row_indices[:taken_rows] + first_row, row_sizes[:taken_rows]))
+            read_rows_number += taken_rows
+            first_row += len(row_sizes) + na_rows
+            if rows_number is not None and read_rows_number >= rows_number:
+                # NA rows after the last taken row are not read from the merged file
+                na_rows_number += int(row_indices[taken_rows - 1]) + 1 - taken_rows if taken_rows > 0 else na_rows
+                break
+            na_rows_number += na_rows
+        if read_rows_number < (rows_number or ROWS_NUMBER):
+            raise Exception('Found only %d proper values of %d in merged file: %s' % (
+                read_rows_number, rows_number or ROWS_NUMBER, path))
+        records.append((interpreter.interpret(path), np.concatenate(values_parts), np.concatenate(repetitions_parts)))
+    instrumentation.count('na_rows', na_rows_number)
+    print 'Reduced partials: %d, files: %d, NA rows: %d' % (len(partials), len(records), na_rows_number)
+    return records
+
+
+def aggregate_partials(output_path, partials_paths, workers=1, aggregation_classes=None, bootstrap=None):
+    """
+    Run aggregations on results combined from partials of shards
+    :param workers: number of processes rendering charts
+    :param aggregation_classes: classes of aggregations to run, all aggregations by default
+    :type bootstrap: aggregate_results.Bootstrap
+    """
+    with instrumentation.stage('reduce'):
+        records = reduce_partials([ShardPartial.load(partial_path) for partial_path in partials_paths])
+    aggregate_records(output_path, records, workers, aggregation_classes, bootstrap)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metrics", help="output path of the JSON lines report of metrics of processing stages")
+    parser.add_argument("--profile",
+                        help="output path of cProfile stats of mapping shards, suffixed with the stage name")
+    subparsers = parser.add_subparsers(dest="command")
+
+    map_parser = subparsers.add_parser("map", help="read shards into partials, named after the shards")
+    map_parser.add_argument("partials_path", help="output directory of partials")
+    map_parser.add_argument("shards_paths", nargs='+', help="paths to shards of results of experiments")
+    map_parser.add_argument("--workers", type=int, default=1,
+                            help="number of processes mapping shards (default: %(default)s)")
+    add_rows_arguments(map_parser)
+    add_path_filter_arguments(map_parser)
+
+    reduce_parser = subparsers.add_parser("reduce", help="aggregate results combined from partials of shards")
+    reduce_parser.add_argument("output_path", help="output path")
+    reduce_parser.add_argument("partials_paths", nargs='+', help="paths to partials of all shards")
+    reduce_parser.add_argument("--workers", type=int, default=1,
+                               help="number of processes rendering charts (default: %(default)s)")
+    add_tests_arguments(reduce_parser)
+    add_bootstrap_arguments(reduce_parser)
+    args = parser.parse_args()
+
+    if args.metrics or args.profile:
+        instrumentation.enable(args.profile)
+    if args.command == 'map':
+        map_shards(args.shards_paths, args.partials_path, args.workers,
+                   get_results_filter(args.distributions, args.matrix_sizes, args.preferences, args.models),
+                   get_rows_number(args))
+    else:
+        aggregate_partials(args.output_path, args.partials_paths, args.workers,
+                           get_aggregation_classes(args.friedman), get_bootstrap(args))
+    if args.metrics:
+        instrumentation.save_report(args.metrics)
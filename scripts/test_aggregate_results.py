@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from aggregate_results import DataType, FriedmanForMethods, Sampling, SamplingBootstrap, WilcoxonForMethods, \
+    get_paired_values, iter_data_records, load_results_table
+from generate_results_tree import generate_tree
+
+
+METHOD_IDS = ['EQUAL_FREQ_INTERVAL', 'EQUAL_WIDTH_INTERVAL', 'GHADERI_DISCRETIZATION', 'KERNEL_DENSITY_ESTIMATION',
+              'K_MEANS']
+NA_ROW = 10
+
+
+def write_results_tree(path):
+    """
+    Write eps values of all methods, with a NA row in files of K_MEANS
+    """
+    random_state = np.random.RandomState(0)
+    # Wilcoxon results are saved for all numbers of comparisons and distributions
+    for distribution in ['SKEW_NORMAL', 'UNIFORM']:
+        for preferences in ['pref-2', 'pref-4', 'pref-6', 'pref-8', 'ranking']:
+            for method_idx, method_id in enumerate(METHOD_IDS):
+                directory = os.path.join(path, distribution, '3x4', preferences, 'SEGMENTED-3-%s' % method_id)
+                os.makedirs(directory)
+                # a value tells its method and row, so pairs of values tell the rows they come from
+                values = method_idx + np.arange(101) / 1000.0 + random_state.uniform(0, 0.0001, 101)
+                rows = ['%f' % value for value in values]
+                if method_id == 'K_MEANS':
+                    rows[NA_ROW] = 'NA'
+                with open(os.path.join(directory, 'epsvalues.csv'), 'w') as data_file:
+                    data_file.write('\n'.join(rows) + '\n')
+
+
+def get_rows(values):
+    return list(np.round(values % 1 * 1000))
+
+
+class WilcoxonWithNaRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_results_tree(os.path.join(self.path, 'merged'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _load_table(self, rows_number):
+        return load_results_table(iter_data_records(os.path.join(self.path, 'merged'), rows_number=rows_number))
+
+    def test_values_are_paired_by_repetition(self):
+        paired_values = get_paired_values(self._load_table(None), DataType.eps)
+        self.assertEqual(10, len(paired_values))
+        for values_by_method in paired_values.itervalues():
+            self.assertEqual(set([100]), set(len(values) for values in values_by_method.itervalues()))
+            # rows of all methods around the NA row of K_MEANS
+            for values in values_by_method.itervalues():
+                self.assertEqual([NA_ROW - 1, NA_ROW + 1, NA_ROW + 2], get_rows(values[NA_ROW - 1:NA_ROW + 2]))
+
+    def test_first_rows_are_paired_by_repetition(self):
+        """
+        The first 100 rows of files are rows 0-99, or rows 0-100 without the NA row, only rows read from files
+        of all methods are paired
+        """
+        paired_values = get_paired_values(self._load_table(100), DataType.eps)
+        for values_by_method in paired_values.itervalues():
+            for values in values_by_method.itervalues():
+                self.assertEqual(range(NA_ROW) + range(NA_ROW + 1, 100), get_rows(values))
+
+    def test_wilcoxon_results_are_saved(self):
+        output_path = os.path.join(self.path, 'output')
+        WilcoxonForMethods(output_path).generate_results(self._load_table(None), [DataType.eps])
+        with open(os.path.join(output_path, 'wilcoxon_eps.csv')) as results_file:
+            self.assertEqual(6, len(results_file.read().splitlines()))
+
+
+class FriedmanWithNaRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_results_tree(os.path.join(self.path, 'merged'))
+        self.table = load_results_table(iter_data_records(os.path.join(self.path, 'merged'), rows_number=None))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_blocks_hold_values_of_a_single_repetition(self):
+        output_path = os.path.join(self.path, 'output')
+        blocks, params_labels, blocks_numbers = FriedmanForMethods(output_path)._get_blocks(self.table, DataType.eps)
+        self.assertEqual(10, len(params_labels))
+        self.assertEqual([100] * 10, list(blocks_numbers))
+        for block in blocks:
+            self.assertEqual(1, len(set(get_rows(block))))
+        self.assertEqual(range(NA_ROW) + range(NA_ROW + 1, 101), get_rows(blocks[:100, 0]))
+
+    def test_friedman_results_are_saved(self):
+        output_path = os.path.join(self.path, 'output')
+        FriedmanForMethods(output_path).generate_results(self.table, [DataType.eps])
+        self.assertTrue(os.listdir(output_path))
+
+
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        generate_tree(self.path, preferences=['pref-2', 'ranking'], char_points=[3],
+                      methods=['EQUAL_FREQ_INTERVAL', 'K_MEANS'])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _load_table(self, sampling):
+        return load_results_table(iter_data_records(self.path, rows_number=None, sampling=sampling))
+
+    def test_configurations_are_sampled_for_all_methods(self):
+        table = self._load_table(Sampling(0.25))
+        matrix_sizes = {}
+        for labels in table.group(Sampling.STRATA_KEYS + ['method_name', 'crit_number', 'alt_number'],
+                                  {'data_type': DataType.eps, 'char_points': 3}):
+            matrix_sizes.setdefault(labels[:3], {}).setdefault(labels[3], set()).add(labels[4:])
+        self.assertEqual(4, len(matrix_sizes))
+        for sizes_by_method in matrix_sizes.itervalues():
+            # two of the four matrix sizes of every stratum, the same for both methods
+            self.assertEqual(2, len(sizes_by_method))
+            self.assertEqual(1, len(set(frozenset(sizes) for sizes in sizes_by_method.itervalues())))
+            self.assertEqual(2, len(sizes_by_method.values()[0]))
+
+    def test_whole_sample_has_no_sampling_error(self):
+        sampling = Sampling(1)
+        table = self._load_table(sampling)
+        means = table.mean(['method_name'], {'data_type': DataType.eps})
+        for labels, (low, high) in table.mean_intervals(['method_name'], SamplingBootstrap(sampling, 100),
+                                                        {'data_type': DataType.eps}).iteritems():
+            self.assertAlmostEqual(means[labels], low)
+            self.assertAlmostEqual(means[labels], high)
+
+    def test_sampling_error_is_estimated(self):
+        sampling = Sampling(0.5)
+        table = self._load_table(sampling)
+        means = table.mean(['method_name'], {'data_type': DataType.eps})
+        for labels, (low, high) in table.mean_intervals(['method_name'], SamplingBootstrap(sampling, 100),
+                                                        {'data_type': DataType.eps}).iteritems():
+            self.assertLess(low, means[labels])
+            self.assertLess(means[labels], high)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,412 @@
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+import gzip
+import json
 import os
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
-def get_all_files_paths(base_directory):
-    paths = []
-    for root, directories, file_names in os.walk(base_directory):
-        for file_name in file_names:
-            paths.append(os.path.join(root, file_name)[len(base_directory.rstrip('/'))+1:])
-    return paths
+COMPRESSION_SUFFIXES = {'gz': '.gz', 'zst': '.zst'}
+GZIP_COMPRESS_LEVEL = 6
+ROWS_NUMBER = 100
+BOOTSTRAP_CONFIDENCE = 0.95
+POLL_INTERVAL = 10
+
+
+class PathFilter:
+    """
+    Filter of paths of results of experiments, which follow the schema:
+    DISTRIBUTION/CxA/pref-N|ranking/MODEL/data type file
+
+    Every level of the schema is given a list of accepted names or fnmatch patterns, e.g. 'SEGMENTED-*-K_MEANS',
+    or None to accept all names. Only files at the level of data type files are accepted.
+    """
+    def __init__(self, distributions=None, matrix_sizes=None, preferences=None, models=None, data_types=None,
+                 skipped_levels=0):
+        """
+        :param skipped_levels: number of directory levels above the schema, e.g. 1 for directories of shards
+        """
+        self.patterns = [distributions, matrix_sizes, preferences, models, data_types]
+        self.skipped_levels = skipped_levels
+
+    def accepts_directory(self, depth, name):
+        level = depth - self.skipped_levels
+        # directories at the level of data type files or below cannot contain accepted files
+        return level < len(self.patterns) - 1 and self._accepts(level, name)
+
+    def accepts_file(self, depth, name):
+        level = depth - self.skipped_levels
+        return level == len(self.patterns) - 1 and self._accepts(level, name)
+
+    def accepts_path(self, path):
+        path_parts = path.split('/')
+        return all(self.accepts_directory(depth, name) for depth, name in enumerate(path_parts[:-1])) and \
+            self.accepts_file(len(path_parts) - 1, path_parts[-1])
+
+    def _accepts(self, level, name):
+        if level < 0 or level >= len(self.patterns) or self.patterns[level] is None:
+            return True
+        return any(fnmatchcase(name, pattern) for pattern in self.patterns[level])
+
+
+def add_path_filter_arguments(parser):
+    """
+    Add arguments restricting directories of results of experiments to read
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--distributions", nargs='+', help="names or patterns of distribution directories to read")
+    parser.add_argument("--matrix-sizes", nargs='+', help="names or patterns of CxA directories to read")
+    parser.add_argument("--preferences", nargs='+', help="names or patterns of pref-N or ranking directories to read")
+    parser.add_argument("--models", nargs='+', help="names or patterns of model directories to read, "
+                                                    "e.g. 'SEGMENTED-*-K_MEANS'")
+
+
+def add_rows_arguments(parser):
+    """
+    Add arguments of the rows read from every result file
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--all-rows", action="store_true",
+                        help="read all rows of result files instead of the first %d" % ROWS_NUMBER)
+
+
+def add_sharded_arguments(parser):
+    """
+    Add arguments of reading shards of results as merged results
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--sharded", action="store_true",
+                        help="read shards of results of experiments as merged results, without merging them")
+
+
+def add_tests_arguments(parser):
+    """
+    Add arguments of statistical tests comparing methods
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--friedman", action="store_true",
+                        help="compare methods with Friedman tests and post-hoc analysis instead of pairwise "
+                             "Wilcoxon tests")
+
+
+def add_bootstrap_arguments(parser):
+    """
+    Add arguments of bootstrap confidence intervals of plotted means
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--bootstrap", type=int, metavar="RESAMPLES",
+                        help="plot bootstrap confidence intervals of means computed from the given number of "
+                             "resamples, and save values of charts with their intervals as CSV tables")
+    parser.add_argument("--confidence", type=float, default=BOOTSTRAP_CONFIDENCE,
+                        help="confidence level of bootstrap intervals (default: %(default)s)")
+
+
+def add_preview_arguments(parser):
+    """
+    Add arguments of previews of charts
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--preview", type=float, metavar="FRACTION",
+                        help="plot charts quickly from all result files of a stratified sample of the given "
+                             "fraction of matrix sizes, with intervals of the sampling error computed by resampling "
+                             "the sampled matrix sizes, --bootstrap sets their number of resamples, tests are not "
+                             "computed")
+
+
+def add_merge_arguments(parser):
+    """
+    Add arguments of merging results of experiments
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes merging files (default: %(default)s)")
+    parser.add_argument("--report", help="path of the JSON verification report "
+                                         "(default: <output_path>-verification.json)")
+    parser.add_argument("--manifest", help="path of the merge manifest (default: <output_path>-manifest.json)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSION_SUFFIXES),
+                        help="compress merged files with gzip or zstd, inputs are decompressed whatever the option")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="merge again from scratch merged files missing from the merge manifest, e.g. merged "
+                             "before manifests existed, instead of refusing to merge")
+
+
+def add_ingest_arguments(parser):
+    """
+    Add arguments of ingesting merged results into a result store
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes parsing result files (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="parse only files added or changed since the previous ingest")
+
+
+def add_watch_arguments(parser):
+    """
+    Add arguments of polling results of experiments in progress
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help="seconds between polls of the results tree (default: %(default)s)")
+    parser.add_argument("--polls", type=int, help="number of polls before exiting, polls until interrupted by default")
+
+
+def list_directory(directory):
+    """
+    Get sorted names of files and of subdirectories to enter.
+    Symbolic links to directories are not entered, as in os.walk.
+    """
+    files_names = []
+    directories_names = []
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    directories_names.append(entry.name)
+            else:
+                files_names.append(entry.name)
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                if not os.path.islink(path):
+                    directories_names.append(name)
+            else:
+                files_names.append(name)
+    return sorted(files_names), sorted(directories_names)
+
+
+def iter_files_paths(base_directory, path_filter=None):
+    """
+    Yield paths of files under the base directory, relative to it, in sorted order of directories and files.
+    Directories rejected by the filter are not entered, so their content is never listed.
+    :param path_filter: filter of paths, all files are yielded if not given
+    :type path_filter: PathFilter
+    """
+    return _iter_files_paths(base_directory, '', 0, path_filter)
+
+
+def _iter_files_paths(directory, relative_directory, depth, path_filter):
+    files_names, directories_names = list_directory(directory)
+    for file_name in files_names:
+        if path_filter is None or path_filter.accepts_file(depth, file_name):
+            yield relative_directory + file_name
+    for directory_name in directories_names:
+        if path_filter is None or path_filter.accepts_directory(depth, directory_name):
+            for path in _iter_files_paths(os.path.join(directory, directory_name),
+                                          relative_directory + directory_name + '/', depth + 1, path_filter):
+                yield path
+
+
+def get_all_files_paths(base_directory, path_filter=None):
+    """
+    Get paths of all files under the base directory, relative to it, in sorted order of directories and files
+    """
+    return list(iter_files_paths(base_directory, path_filter))
+
+
+def group_by_output_file(files_paths, compression=None):
+    """
+    Group input files of shards by their output file, inputs compressed in any way are merged into the same output
+    :param files_paths: paths of files of shards, relative to the directory of shards
+    :param compression: compression of output files, 'gz', 'zst' or None
+    :return: OrderedDict of lists of input files by relative path of output file
+    """
+    inputs_by_output = OrderedDict()
+    for file_path in files_paths:
+        output_relative_path = add_compression_suffix(strip_compression_suffix(file_path[file_path.index('/') + 1:]),
+                                                      compression)
+        inputs_by_output.setdefault(output_relative_path, []).append(file_path)
+    return inputs_by_output
+
+
+class ShardedFile:
+    """
+    File of merged results given by the files of shards which would be appended to it, in the order of shards.
+    Opened with open_result_file, it is read as the merged file would be, without copying the files of shards.
+    """
+    def __init__(self, relative_path, paths):
+        """
+        :param relative_path: path of the file relative to merged results
+        :param paths: paths of files of shards
+        """
+        self.relative_path = relative_path
+        self.paths = paths
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedFile) and self.paths == other.paths
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self.paths))
+
+    def __str__(self):
+        return self.relative_path
+
+
+def iter_sharded_files(shards_path, path_filter=None):
+    """
+    Yield files of merged results of shards without merging them, in the order of a walk of merged results
+    :param shards_path: path to shards of results of experiments
+    :param path_filter: filter of paths of files of shards, with the level of shard directories skipped
+    :type path_filter: PathFilter
+    :return: generator of ShardedFile
+    """
+    inputs_by_output = group_by_output_file(iter_files_paths(shards_path, path_filter))
+    for relative_path in sorted(inputs_by_output, key=lambda path: path.split('/')):
+        yield ShardedFile(relative_path, [os.path.join(shards_path, input_path)
+                                          for input_path in inputs_by_output[relative_path]])
+
+
+def get_compression(path):
+    """
+    :return: 'gz' or 'zst' for compressed files, None otherwise
+    """
+    for compression, suffix in COMPRESSION_SUFFIXES.iteritems():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_compression_suffix(path):
+    compression = get_compression(path)
+    return path[:-len(COMPRESSION_SUFFIXES[compression])] if compression else path
+
+
+def add_compression_suffix(path, compression):
+    return path + COMPRESSION_SUFFIXES[compression] if compression else path
+
+
+def _check_zstandard():
+    if zstandard is None:
+        raise ImportError('zstd compressed files need the zstandard package')
+
+
+class ZstdReader:
+    """
+    Streaming reader of a zstd file, which may consist of many concatenated frames
+    """
+    def __init__(self, path):
+        _check_zstandard()
+        self._file = open(path, 'rb')
+        self._reader = zstandard.ZstdDecompressor().stream_reader(self._file, read_across_frames=True)
+
+    def read(self, size):
+        return self._reader.read(size)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ZstdFrameWriter:
+    """
+    Writer of a single zstd frame to an open file, closing the writer ends the frame and leaves the file open
+    """
+    def __init__(self, output_file):
+        _check_zstandard()
+        self._writer = zstandard.ZstdCompressor().stream_writer(output_file)
+
+    def write(self, data):
+        self._writer.write(data)
+
+    def close(self):
+        self._writer.flush(zstandard.FLUSH_FRAME)
+
+
+class ConcatenatedReader:
+    """
+    Reader of files of shards one after another, as a single stream. Every file is opened only once the previous
+    one is read, so files past the part of the stream that is read are never opened.
+    """
+    def __init__(self, paths):
+        self._paths = paths
+        self._path_idx = 0
+        self._file = None
+
+    def read(self, size):
+        while self._path_idx < len(self._paths):
+            if self._file is None:
+                self._file = open_result_file(self._paths[self._path_idx])
+            block = self._file.read(size)
+            if block:
+                return block
+            self._file.close()
+            self._file = None
+            self._path_idx += 1
+        return ''
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class UncompressedWriter:
+    def __init__(self, output_file):
+        self._file = output_file
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        pass
+
+
+def open_result_file(path):
+    """
+    Open a result file for reading in binary blocks, gzip and zstd files are decompressed while they are read
+    :param path: path to the file, or a ShardedFile read as a merged file
+    """
+    if isinstance(path, ShardedFile):
+        return ConcatenatedReader(path.paths)
+    compression = get_compression(path)
+    if compression == 'gz':
+        return gzip.open(path, 'rb')
+    if compression == 'zst':
+        return ZstdReader(path)
+    return open(path, 'rb')
+
+
+def start_compressed_writer(output_file, compression):
+    """
+    Start writing data to an open binary file as a new gzip member or zstd frame, or as it is.
+    Closing the returned writer ends the member or frame and leaves the file open. Files of concatenated members
+    or frames are read back as a single stream, so data may be appended to compressed files.
+    :param compression: 'gz', 'zst' or None
+    """
+    if compression == 'gz':
+        return gzip.GzipFile(filename='', mode='wb', compresslevel=GZIP_COMPRESS_LEVEL, fileobj=output_file, mtime=0)
+    if compression == 'zst':
+        return ZstdFrameWriter(output_file)
+    return UncompressedWriter(output_file)
+
+
+def write_json_atomically(path, data):
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as output_file:
+        json.dump(data, output_file, sort_keys=True)
+    os.rename(tmp_path, path)
@@ -0,0 +1,260 @@
+"""
+Watch mode of aggregations, following a results tree while experiments append rows to its files.
+
+Every result file is read from the offset where the previous read stopped, and only until it holds the rows
+read by aggregations, so a refresh reads only new bytes. Directories are listed again only when their
+modification time changes. A single results table is kept, in which only values of files which got new rows are
+replaced, so reading and parsing follow the rate of new rows. Aggregations and tests are then computed again over
+the whole table for every data type of these files, so their cost grows with the size of the tree, only charts
+whose data did not change are not rendered again.
+"""
+import argparse
+import os
+import time
+import numpy as np
+from aggregate_results import AGGREGATIONS, READ_BLOCK_SIZE, ChartRenderer, MissingResultsError, PathInterpreter, \
+    ResultsTable, get_aggregation_classes, get_bootstrap, get_repetitions, get_results_filter, get_row_sizes, \
+    get_rows_number, keep_rows, parse_data_rows, select_data_types, skips_na
+from instrumentation import instrumentation
+from utils import POLL_INTERVAL, ROWS_NUMBER, add_bootstrap_arguments, add_path_filter_arguments, add_rows_arguments, \
+    add_tests_arguments, add_watch_arguments, get_compression, list_directory, open_result_file
+
+
+
+
+class TailedResultFile:
+    """
+    Result file read in increments, each starting where the previous one stopped.
+
+    Rows are selected as by read_rows: a row is read once it is complete, rows containing NA are skipped in files
+    which may contain them, and reading stops after rows_number rows. Compressed files are decompressed from
+    their beginning, skipping the part read before.
+    """
+    def __init__(self, data_unit, rows_number=ROWS_NUMBER):
+        """
+        :param rows_number: number of rows to read, all rows if None
+        """
+        self.data_unit = data_unit
+        self.rows_number = rows_number
+        # record of the file in the results table, once it is ready
+        self.record = None
+        self._reset()
+
+    def _reset(self):
+        self.rows_read = 0
+        self._rows_scanned = 0
+        self._file_size = 0
+        self._offset = 0
+        self._rest = ''
+        self._values = []
+        self._repetitions = []
+
+    def is_complete(self):
+        return self.rows_number is not None and self.rows_read >= self.rows_number
+
+    def is_ready(self):
+        """
+        Whether the file has enough rows to be aggregated
+        """
+        return self.rows_read >= (self.rows_number or ROWS_NUMBER)
+
+    def get_values(self):
+        """
+        :return: values of the read rows and their repetitions of experiments
+        """
+        if len(self._values) > 1:
+            self._values = [np.concatenate(self._values)]
+            self._repetitions = [np.concatenate(self._repetitions)]
+        return self._values[0], self._repetitions[0]
+
+    def update(self):
+        """
+        Read rows appended since the previous update
+        :return: whether new rows were read
+        """
+        file_size = os.path.getsize(self.data_unit.path)
+        if file_size == self._file_size:
+            return False
+        if file_size < self._file_size:
+            # the file was written again from scratch
+            self._reset()
+        rows_read = self.rows_read
+        instrumentation.count('files_read')
+        with open_result_file(self.data_unit.path) as data_file:
+            if get_compression(self.data_unit.path) is None:
+                data_file.seek(self._offset)
+            else:
+                skipped_size = 0
+                while skipped_size < self._offset:
+                    block = data_file.read(min(READ_BLOCK_SIZE, self._offset - skipped_size))
+                    if not block:
+                        break
+                    skipped_size += len(block)
+            while not self.is_complete():
+                block = data_file.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                instrumentation.count('bytes_read', len(block))
+                self._offset += len(block)
+                rows = (self._rest + block).split('\n')
+                self._rest = rows.pop()
+                self._add_rows(rows)
+        self._file_size = file_size
+        return self.rows_read > rows_read
+
+    def _add_rows(self, rows):
+        rows_left = self.rows_number - self.rows_read if self.rows_number is not None else None
+        kept_rows, kept_indices, na_rows = keep_rows(rows, skips_na(self.data_unit.data_type), rows_left,
+                                                     self.data_unit.path, self._rows_scanned)
+        self._rows_scanned += len(kept_rows) + na_rows
+        if not kept_rows:
+            return
+        self._values.append(parse_data_rows(kept_rows, self.data_unit.data_type, self.data_unit.path))
+        self._repetitions.append(get_repetitions(kept_indices, get_row_sizes(kept_rows)))
+        self.rows_read += len(kept_rows)
+
+
+class ResultsWatcher:
+    """
+    Follows result files of a results tree, including files created after the watch started
+    """
+    def __init__(self, data_path, path_filter=None, rows_number=ROWS_NUMBER):
+        """
+        :param data_path: path to results of experiments, in the layout of merged results
+        :type path_filter: utils.PathFilter
+        :param rows_number: number of rows read from every file, all rows if None
+        """
+        self.data_path = data_path
+        self.path_filter = path_filter or get_results_filter()
+        self.rows_number = rows_number
+        self._interpreter = PathInterpreter(data_path)
+        self._directories = {}
+        self._files = {}
+        self._pending_paths = set()
+        self._table = ResultsTable()
+
+    def poll(self):
+        """
+        Find new result files and read rows appended to files which are not read completely yet. Values of files
+        ready to be aggregated which got new rows are added to the results table or replaced in it.
+        :return: set of data types of files ready to be aggregated which got new rows
+        """
+        self._scan_directory('', 0)
+        data_types = set()
+        # files ready at once are added in the order of a walk of the tree, so aggregations of a tree which
+        # does not change get the same results as from a run of aggregate_results.py
+        for path in sorted(self._pending_paths, key=lambda path: path.split('/')):
+            result_file = self._files[path]
+            if result_file.update() and result_file.is_ready():
+                if result_file.record is None:
+                    result_file.record = self._table.add(result_file.data_unit, *result_file.get_values())
+                else:
+                    self._table.replace(result_file.record, *result_file.get_values())
+                data_types.add(result_file.data_unit.data_type)
+            if result_file.is_complete():
+                self._pending_paths.remove(path)
+        return data_types
+
+    def get_table(self):
+        """
+        Get the results table of files ready to be aggregated
+        :rtype: ResultsTable
+        """
+        return self._table
+
+    def _scan_directory(self, relative_directory, depth):
+        """
+        List a directory again if it was modified since it was listed, then scan its subdirectories
+        """
+        directory = os.path.join(self.data_path, relative_directory)
+        mtime = os.stat(directory).st_mtime
+        if relative_directory not in self._directories or self._directories[relative_directory][0] != mtime:
+            files_names, directories_names = list_directory(directory)
+            for file_name in files_names:
+                path = relative_directory + file_name
+                if path not in self._files and self.path_filter.accepts_file(depth, file_name):
+                    data_unit = self._interpreter.interpret(path)
+                    if data_unit is not None:
+                        self._files[path] = TailedResultFile(data_unit, self.rows_number)
+                        self._pending_paths.add(path)
+            self._directories[relative_directory] = (mtime, [
+                directory_name for directory_name in directories_names
+                if self.path_filter.accepts_directory(depth, directory_name)])
+        for directory_name in self._directories[relative_directory][1]:
+            self._scan_directory(relative_directory + directory_name + '/', depth + 1)
+
+
+def refresh_results(aggregations, table, data_types, renderer):
+    """
+    Generate results of aggregations for the given data types from all values of the table, saving their tables
+    of tests again, and render their changed charts
+    :type renderer: ChartRenderer
+    """
+    charts = []
+    for aggregation in aggregations:
+        for data_type in select_data_types(data_types):
+            try:
+                charts.extend(aggregation.generate_results(table, [data_type]))
+            except MissingResultsError as e:
+                # results of a campaign in progress may miss parameters some aggregations need,
+                # they are generated again once new rows come
+                print 'Results of %s for %s not refreshed: %s' % (aggregation.__class__.__name__, data_type.name, e)
+    renderer.render(charts)
+
+
+def watch(output_path, data_path, interval=POLL_INTERVAL, path_filter=None, rows_number=ROWS_NUMBER, workers=1,
+          aggregation_classes=None, bootstrap=None, polls=None):
+    """
+    Refresh results of aggregations whenever rows are appended to result files
+    :param output_path: output path
+    :param data_path: path to results of experiments, in the layout of merged results
+    :param interval: seconds between polls of the tree
+    :param rows_number: number of rows read from every file, all rows if None
+    :param workers: number of processes rendering charts
+    :param aggregation_classes: classes of aggregations to run, all aggregations by default
+    :type bootstrap: aggregate_results.Bootstrap
+    :param polls: number of polls before returning, the tree is polled until interrupted if None
+    """
+    watcher = ResultsWatcher(data_path, path_filter, rows_number)
+    aggregations = [aggregation_class(output_path, bootstrap)
+                    for aggregation_class in aggregation_classes or AGGREGATIONS]
+    renderer = ChartRenderer(workers)
+    polls_number = 0
+    while True:
+        with instrumentation.stage('poll'):
+            data_types = watcher.poll()
+        if data_types:
+            with instrumentation.stage('refresh'):
+                refresh_results(aggregations, watcher.get_table(), data_types, renderer)
+            print 'Refreshed results of: %s' % ', '.join(data_type.name for data_type in select_data_types(data_types))
+        polls_number += 1
+        if polls is not None and polls_number >= polls:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_path", help="output path")
+    parser.add_argument("data_path", help="path to results of experiments")
+    add_watch_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes rendering charts (default: %(default)s)")
+    add_rows_arguments(parser)
+    add_tests_arguments(parser)
+    parser.add_argument("--metrics", help="output path of the JSON lines report of metrics of processing stages")
+    add_path_filter_arguments(parser)
+    add_bootstrap_arguments(parser)
+    args = parser.parse_args()
+
+    if args.metrics:
+        instrumentation.enable()
+    try:
+        watch(args.output_path, args.data_path, args.interval,
+              get_results_filter(args.distributions, args.matrix_sizes, args.preferences, args.models),
+              get_rows_number(args), args.workers, get_aggregation_classes(args.friedman),
+              get_bootstrap(args), args.polls)
+    except KeyboardInterrupt:
+        pass
+    if args.metrics:
+        instrumentation.save_report(args.metrics)